@@ -1,13 +1,54 @@
 # app/routes/anomaly_route.py
 
+import os
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 # Servisimizi import ediyoruz
-from app.services.anomaly_detection_service import anomaly_service
+from app.services.anomaly_detection_service import anomaly_service, HistoryVersionMismatch, ModelFitBusy
 
 # '/api/anomaly' önekiyle yeni bir Blueprint oluşturuyoruz
 anomaly_bp = Blueprint('anomaly_api', __name__, url_prefix='/api/anomaly')
 
+# /check-batch isteğinde kabul edilecek en fazla yeni işlem sayısı
+MAX_BATCH_SIZE = int(os.getenv('ANOMALY_MAX_BATCH_SIZE', '1000'))
+# Eğitim kuyruğu doluyken (503) istemciye önerilen bekleme süresi (saniye)
+FIT_BUSY_RETRY_AFTER = int(os.getenv('ANOMALY_FIT_BUSY_RETRY_AFTER', '5'))
+
+
+def _history_conflict_response(error):
+    """Delta'nın temel sürümü bizdekiyle uyuşmuyor: server_api tam geçmişi yeniden göndermeli."""
+    return jsonify({
+        "error": str(error),
+        "resync_required": True,
+        "history_version": error.current_version
+    }), 409
+
+
+class ForbiddenModelUser(Exception):
+    """Token sahibi, istekteki 'user_id' kullanıcısının modeli üzerinde işlem yapamaz."""
+
+
+def _model_user_id(data, current_user_id):
+    """
+    Modelin saklanacağı kullanıcı. Gövdedeki 'user_id' sadece token sahibinin
+    kendisiyse veya token ADMIN rolündeyse (başka kullanıcı adına işlem) kabul edilir;
+    aksi halde başka bir kullanıcının modeli okunabilir veya bozulabilirdi.
+    """
+    requested_user_id = data.get('user_id')
+    if not requested_user_id or requested_user_id == current_user_id:
+        return current_user_id
+    if get_jwt().get('role') == 'ADMIN':
+        return requested_user_id
+    raise ForbiddenModelUser("Başka bir kullanıcının modeli üzerinde işlem yapma yetkiniz yok.")
+
+
+def _fit_busy_response(error):
+    """Eğitim kuyruğu dolu: istemci kısa bir süre sonra tekrar denemeli."""
+    response = jsonify({"error": str(error)})
+    response.headers['Retry-After'] = str(FIT_BUSY_RETRY_AFTER)
+    return response, 503
+
+
 @anomaly_bp.route('/check-transaction', methods=['POST'])
 @jwt_required()
 def check_transaction_route():
@@ -17,11 +58,19 @@ def check_transaction_route():
     
     GİRDİ (Input) JSON Body:
     {
+        "user_id": "...",              # Opsiyonel: modelin saklanacağı kullanıcı (yoksa token kimliği)
+        "history_version": "...",      # Opsiyonel: geçmiş sürümü (yoksa geçmişin hash'i kullanılır)
         "user_history": [
-            {"date": "2025-10-20...", "amount": 100.0, "category": "Market", "type": "expense"},
-            {"date": "2025-10-22...", "amount": 250.0, "category": "Alışveriş", "type": "expense"},
+            {"id": "...", "date": "2025-10-20...", "amount": 100.0, "category": "Market", "type": "expense"},
+            {"id": "...", "date": "2025-10-22...", "amount": 250.0, "category": "Alışveriş", "type": "expense"},
             ... (tüm geçmiş işlemler) ...
         ],
+        # VEYA 'user_history' yerine, son sürümden bu yana değişenler:
+        "history_delta": {
+            "base_version": "...",     # Bir önceki yanıttaki 'history_version'
+            "upserts": [ ... (eklenen/değişen işlemler, 'id' ile) ... ],
+            "deletes": [ ... (silinen işlem id'leri) ... ]
+        },
         "new_transaction": {
             "date": "2025-11-03T22:30:00", 
             "amount": 7000.0, 
@@ -29,24 +78,34 @@ def check_transaction_route():
             "type": "expense"
         }
     }
+
+    ÇIKTI (Output) JSON: 'history_version' bir sonraki delta için temel sürümdür.
+    'score' IsolationForest skorudur (düşük = daha anormal; model çalışmadıysa null).
+    Delta'nın temel sürümü uyuşmazsa 409 döner ve tam geçmiş yeniden gönderilmelidir.
     """
     # Token'ı sadece yetkilendirme için kontrol ediyoruz
     current_user_id = get_jwt_identity() 
     data = request.get_json()
     
     # Gerekli tüm alanların geldiğinden emin ol
-    if not data or 'user_history' not in data or 'new_transaction' not in data:
-        return jsonify({"error": "Eksik parametreler: 'user_history' ve 'new_transaction' gereklidir."}), 400
+    if not data or ('user_history' not in data and 'history_delta' not in data) or 'new_transaction' not in data:
+        return jsonify({"error": "Eksik parametreler: 'user_history' (veya 'history_delta') ve 'new_transaction' gereklidir."}), 400
     
     try:
         # Gelen veriyi değişkenlere ata
-        user_history_list = data['user_history']
+        user_history_list = data.get('user_history')
         new_transaction_dict = data['new_transaction']
+        # Admin başka bir kullanıcı adına işlem ekleyebildiği için model,
+        # token sahibine değil işlemin sahibine göre saklanır
+        model_user_id = _model_user_id(data, current_user_id)
 
         # Servisteki asıl anomali tespit fonksiyonunu çağır
-        is_anomaly, message = anomaly_service.check_transaction(
+        is_anomaly, message, score, history_version = anomaly_service.check_transaction(
             user_history_list,
-            new_transaction_dict
+            new_transaction_dict,
+            user_id=model_user_id,
+            history_version=data.get('history_version'),
+            history_delta=data.get('history_delta')
         )
         
         # Başarılı tahmini döndür
@@ -54,9 +113,17 @@ def check_transaction_route():
         return jsonify({
             "is_anomaly": is_anomaly,
             "message": message,
+            "score": score,
+            "history_version": history_version,
             "user_id": current_user_id # Bilgi amaçlı
         }), 200
 
+    except ForbiddenModelUser as e:
+        return jsonify({"error": str(e)}), 403
+    except HistoryVersionMismatch as e:
+        return _history_conflict_response(e)
+    except ModelFitBusy as e:
+        return _fit_busy_response(e)
     except ValueError as e:
         # Servisten gelen (örn: "Yetersiz işlem geçmişi") hataları yakala
         # Bu bir anomali değil, sadece bir uyarı
@@ -64,4 +131,75 @@ def check_transaction_route():
     except Exception as e:
         # Modelin çalışması sırasındaki beklenmedik hatalar
         print(f"HATA (Anomaly Route): {str(e)}")
-        return jsonify({"error": "Anomali tespiti yapılırken bir sunucu hatası oluştu."}), 500
\ No newline at end of file
+        return jsonify({"error": "Anomali tespiti yapılırken bir sunucu hatası oluştu."}), 500
+
+@anomaly_bp.route('/check-batch', methods=['POST'])
+@jwt_required()
+def check_batch_route():
+    """
+    İçe aktarma, geçmiş doldurma ve mobil çevrimdışı senkronizasyon için
+    birden fazla yeni işlemi tek bir geçmişe karşı toplu olarak kontrol eder.
+    Model bir kez eğitilir (veya kayıt defterinden alınır) ve tüm işlemler
+    tek seferde tahmin edilir.
+    
+    GİRDİ (Input) JSON Body:
+    {
+        "user_id": "...",              # Opsiyonel
+        "history_version": "...",      # Opsiyonel
+        "user_history": [ ... (tüm geçmiş işlemler) ... ],   # VEYA "history_delta": {...}
+        "new_transactions": [
+            {"id": "tx-1", "date": "2025-11-03T22:30:00", "amount": 7000.0, "category": "Alışveriş", "type": "expense"},
+            ...
+        ]
+    }
+
+    ÇIKTI (Output) JSON: Her yeni işlem için, gönderilen sırayla bir sonuç
+    ('id' gönderildiyse aynen geri döner).
+    """
+    current_user_id = get_jwt_identity()
+    data = request.get_json()
+
+    if not data or ('user_history' not in data and 'history_delta' not in data) or 'new_transactions' not in data:
+        return jsonify({"error": "Eksik parametreler: 'user_history' (veya 'history_delta') ve 'new_transactions' gereklidir."}), 400
+
+    new_transaction_list = data['new_transactions']
+    if not isinstance(new_transaction_list, list):
+        return jsonify({"error": "'new_transactions' bir liste olmalıdır."}), 400
+    if len(new_transaction_list) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Tek istekte en fazla {MAX_BATCH_SIZE} işlem gönderilebilir."}), 400
+
+    try:
+        model_user_id = _model_user_id(data, current_user_id)
+        verdicts, history_version = anomaly_service.check_batch(
+            data.get('user_history'),
+            new_transaction_list,
+            user_id=model_user_id,
+            history_version=data.get('history_version'),
+            history_delta=data.get('history_delta')
+        )
+
+        results = []
+        for new_transaction, (is_anomaly, message, score) in zip(new_transaction_list, verdicts):
+            result = {"is_anomaly": is_anomaly, "message": message, "score": score}
+            if isinstance(new_transaction, dict) and 'id' in new_transaction:
+                result["id"] = new_transaction['id']
+            results.append(result)
+
+        return jsonify({
+            "results": results,
+            "anomalies_detected": sum(1 for r in results if r["is_anomaly"]),
+            "history_version": history_version,
+            "user_id": current_user_id # Bilgi amaçlı
+        }), 200
+
+    except ForbiddenModelUser as e:
+        return jsonify({"error": str(e)}), 403
+    except HistoryVersionMismatch as e:
+        return _history_conflict_response(e)
+    except ModelFitBusy as e:
+        return _fit_busy_response(e)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"HATA (Anomaly Batch Route): {str(e)}")
+        return jsonify({"error": "Toplu anomali tespiti yapılırken bir sunucu hatası oluştu."}), 500
@@ -7,172 +7,753 @@ from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import silhouette_score
 import warnings
 import datetime 
+import copy
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 # Uyarıları bastır
 warnings.filterwarnings('ignore')
 
 # --------------------------------------------------------------------
-# 1. 'UserAnomalyModel' SINIFI
+# 0. 'RunningStats' SINIFI
+# Bir kategorideki harcamaların sayısını, ortalamasını ve kare
+# sapmalar toplamını (M2) Welford yöntemiyle tutar. 3-sigma eşiği
+# geçmişi yeniden taramadan sabit zamanda hesaplanır.
+# --------------------------------------------------------------------
+class RunningStats:
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def update(self, value):
+        """Yeni bir tutarı istatistiklere ekler (Welford)."""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        # Pandas .std() ile aynı: örneklem standart sapması (ddof=1)
+        if self.count < 2:
+            return float('nan')
+        return (self.m2 / (self.count - 1)) ** 0.5
+
+    def outlier_threshold(self, n_sigma=3):
+        """Eşik = ortalama + n_sigma * std. Yeterli yayılım yoksa None."""
+        std = self.std
+        if not np.isfinite(std) or std <= 0:
+            return None
+        return self.mean + (n_sigma * std)
+
+
+# --------------------------------------------------------------------
+# 1. ÖZELLİK HAZIRLAMA (NumPy)
+# İşlem kayıtlarını (dict listesi) DataFrame kurmadan doğrudan NumPy
+# dizilerine çevirir. Eski pandas yoluyla (kopya + pd.to_datetime +
+# dropna) aynı satırları atar: tarihi okunamayan, tutarı veya
+# kategorisi eksik olan işlemler kullanılmaz.
+# --------------------------------------------------------------------
+FeatureArrays = namedtuple('FeatureArrays', ['index', 'amount', 'day_of_week', 'category', 'type'])
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    if _is_missing(value):
+        return None
+    # ISO dışı biçimler için pandas'ın esnek ayrıştırıcısına düş (nadir yol)
+    parsed = pd.to_datetime(value, errors='coerce')
+    return None if pd.isna(parsed) else parsed
+
+
+def _parse_amount(value):
+    if _is_missing(value):
+        return None
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if amount != amount else amount
+
+
+def prepare_features(records, expense_only=False):
+    """
+    İşlem kayıtlarından özellik dizilerini üretir.
+    'index', atılmayan kayıtların girdi listesindeki sırasıdır.
+    """
+    index, amounts, days, categories, types = [], [], [], [], []
+    for i, record in enumerate(records):
+        tx_type = str(record.get('type') or '').lower()
+        if expense_only and tx_type != 'expense':
+            continue
+        category = record.get('category')
+        if _is_missing(category):
+            continue
+        amount = _parse_amount(record.get('amount'))
+        if amount is None:
+            continue
+        date = _parse_date(record.get('date'))
+        if date is None:
+            continue
+        index.append(i)
+        amounts.append(amount)
+        days.append(date.weekday())
+        categories.append(category)
+        types.append(tx_type)
+
+    category_array = np.empty(len(categories), dtype=object)
+    category_array[:] = categories
+    return FeatureArrays(
+        index=np.asarray(index, dtype=np.intp),
+        amount=np.asarray(amounts, dtype=float),
+        day_of_week=np.asarray(days, dtype=np.int64),
+        category=category_array,
+        type=np.asarray(types, dtype=object)
+    )
+
+
+def _as_records(transactions):
+    """DataFrame, tek bir dict veya dict listesini kayıt listesine çevirir."""
+    if isinstance(transactions, pd.DataFrame):
+        return transactions.to_dict('records')
+    if isinstance(transactions, dict):
+        return [transactions]
+    return transactions
+
+
+# --------------------------------------------------------------------
+# 2. 'UserAnomalyModel' SINIFI
 # Bu, sizin test script'inizden alınan, modelin tüm mantığını 
 # içeren sınıftır.
 # --------------------------------------------------------------------
 class UserAnomalyModel:
-    def __init__(self, contamination=0.05, min_transactions_to_train=20):
+    def __init__(self, contamination=0.05, min_transactions_to_train=20,
+                 incremental_window=None, max_growth=None, drift_threshold=None):
         # NOT: contamination=0.05, işlemlerin %5'inin anormal olduğunu varsayar.
         # Bu değeri projenize göre ayarlayabilirsiniz (örn: 0.02)
         self.contamination = contamination
         self.min_transactions = min_transactions_to_train
-        self.model = IsolationForest(contamination=self.contamination, random_state=42, n_estimators=100)
+        self.random_state = 42
+        self.model = IsolationForest(contamination=self.contamination, random_state=self.random_state, n_estimators=100)
         self.category_encoder = LabelEncoder()
-        # Modelin kullanacağı özellikler
+        # Modelin kullanacağı özellikler (özellik matrisindeki sütun sırası)
         self.features = ['amount', 'day_of_week', 'category_encoded']
         self.is_fitted = False
         self.user_history = None 
+        # Kategori adı -> LabelEncoder kodu (transform'un sözlük karşılığı)
+        self.category_codes = {}
+        # Kategori adı -> RunningStats (3-sigma kuralı için)
+        self.category_stats = {}
 
-    def _prepare_data(self, df):
-        """
-        Gelen DataFrame'i işler: tarihi datetime'a çevirir,
-        haftanın gününü hesaplar ve eksik verileri atar.
-        """
-        df_copy = df.copy()
-        df_copy['date'] = pd.to_datetime(df_copy['date'], errors='coerce')
-        df_copy['day_of_week'] = df_copy['date'].dt.dayofweek
-        df_copy.dropna(subset=['date', 'day_of_week', 'amount', 'category'], inplace=True)
-        return df_copy
+        # Artımlı (warm_start) büyütme ayarları, bkz. 'grow'
+        # incremental_window: yeni ağaçların eğitildiği son işlem sayısı (0 ise kapalı)
+        # max_growth: son tam eğitimden bu yana eklenen işlem oranı bunu aşınca tam eğitim
+        # drift_threshold: pencere ortalaması, tam eğitimdeki ortalamadan bu kadar
+        #                  standart sapma uzaklaşınca tam eğitim
+        if incremental_window is None:
+            incremental_window = int(os.getenv('ANOMALY_INCREMENTAL_WINDOW', '1024'))
+        if max_growth is None:
+            max_growth = float(os.getenv('ANOMALY_INCREMENTAL_MAX_GROWTH', '0.5'))
+        if drift_threshold is None:
+            drift_threshold = float(os.getenv('ANOMALY_INCREMENTAL_DRIFT', '1.0'))
+        self.incremental_window = incremental_window
+        self.max_growth = max_growth
+        self.drift_threshold = drift_threshold
+        self.full_fit_rows = 0
+        self.rows_since_full_fit = 0
+        self.growth_steps = 0
+        self.baseline_mean = None
+        self.baseline_std = None
+
+    @staticmethod
+    def _feature_matrix(amounts, days, codes):
+        return np.column_stack([amounts, days, codes])
 
-    def fit(self, user_history_df):
+    def fit(self, user_history):
         """
         Modeli, verilen kullanıcının işlem geçmişine göre eğitir (fit eder).
+        Geçmiş bir kayıt listesi (veya DataFrame) olabilir.
         """
-        # Sadece 'expense' (gider) işlemlerini al
-        expense_history = user_history_df[user_history_df['type'].str.lower() == 'expense'].copy()
-        
-        user_history_df_prepared = self._prepare_data(expense_history)
+        # Sadece 'expense' (gider) işlemlerini al ve özellik dizilerine çevir
+        prepared = prepare_features(_as_records(user_history), expense_only=True)
         
         # Eğer kullanıcının geçmişi, belirlediğimiz minimum işlem sayısından azsa,
         # modeli "eğitilmedi" olarak işaretle ve çık.
-        if len(user_history_df_prepared) < self.min_transactions:
+        if len(prepared.amount) < self.min_transactions:
             self.is_fitted = False
-            print(f"Uyarı: Yetersiz veri ({len(user_history_df_prepared)}). Model eğitilemedi.")
+            print(f"Uyarı: Yetersiz veri ({len(prepared.amount)}). Model eğitilemedi.")
             return
 
-        # 1. Kategori kodlayıcıyı (LabelEncoder) eğit
-        self.category_encoder.fit(user_history_df_prepared['category'])
-        
-        # 2. Kategorileri sayısallaştır
-        user_history_df_prepared['category_encoded'] = self.category_encoder.transform(user_history_df_prepared['category'])
+        # 1. Kategori kodlayıcıyı (LabelEncoder) eğit ve kategorileri sayısallaştır
+        codes = self.category_encoder.fit_transform(prepared.category)
+        self.category_codes = {category: code for code, category in enumerate(self.category_encoder.classes_)}
         
-        # 3. Anomali modelini (IsolationForest) eğit
-        self.model.fit(user_history_df_prepared[self.features])
+        # 2. Anomali modelini (IsolationForest) eğit
+        self.model.fit(self._feature_matrix(prepared.amount, prepared.day_of_week, codes))
         
-        # 4. İstatistiksel kurallar için işlenmiş veriyi sakla
-        self.user_history = user_history_df_prepared 
+        # 3. İstatistiksel kurallar için işlenmiş veriyi ve kategori istatistiklerini sakla
+        self.user_history = prepared 
+        self.category_stats = self._build_category_stats(prepared.amount, codes)
+        self.full_fit_rows = len(prepared.amount)
+        self.rows_since_full_fit = 0
+        self.growth_steps = 0
+        self.baseline_mean = float(prepared.amount.mean())
+        self.baseline_std = float(prepared.amount.std())
         self.is_fitted = True
-        print(f"Model, {len(self.user_history)} gider işlemi ile eğitildi.")
+        print(f"Model, {len(prepared.amount)} gider işlemi ile eğitildi.")
+
+    def _window_drift(self, window_amounts):
+        """Pencere ortalamasının tam eğitimdeki ortalamadan kaç standart sapma uzak olduğu."""
+        shift = abs(float(window_amounts.mean()) - self.baseline_mean)
+        if self.baseline_std > 0:
+            return shift / self.baseline_std
+        return 0.0 if shift == 0 else math.inf
+
+    def grow(self, new_records):
+        """
+        Geçmişe eklenen yeni işlemlerle modeli sıfırdan eğitmeden büyütür.
+
+        IsolationForest 'warm_start' ile son 'incremental_window' işlem
+        üzerinde yeni ağaçlar eğitilir, aynı sayıda en eski ağaç emekliye
+        ayrılır ve eşik (offset_) bu pencereye göre yeniden hesaplanır.
+        Eklenen ağaç sayısı yeni işlem sayısıyla orantılı olduğundan işlem
+        başına eğitim maliyeti sabit kalır.
+
+        Mevcut model değiştirilmez (başka istekler onu kullanıyor olabilir);
+        yeni bir model döndürülür. Tam eğitim gerekiyorsa (yeni kategori,
+        boyut veya kayma eşiği aşıldı) None döner.
+        """
+        if not self.is_fitted or self.incremental_window <= 0:
+            return None
+
+        prepared = prepare_features(_as_records(new_records), expense_only=True)
+        n_new = len(prepared.amount)
+        if n_new == 0:
+            # Kullanılabilir yeni gider yok; tam eğitim de bunları atardı
+            return self
+
+        # Yeni kategori LabelEncoder'ı değiştirir: tam eğitim gerekir
+        new_codes = np.fromiter((self.category_codes.get(c, -1) for c in prepared.category), dtype=np.int64, count=n_new)
+        if (new_codes < 0).any():
+            return None
+
+        rows_since_full_fit = self.rows_since_full_fit + n_new
+        if rows_since_full_fit > self.max_growth * self.full_fit_rows:
+            return None
+
+        history = FeatureArrays(
+            index=np.arange(len(self.user_history.amount) + n_new),
+            amount=np.concatenate([self.user_history.amount, prepared.amount]),
+            day_of_week=np.concatenate([self.user_history.day_of_week, prepared.day_of_week]),
+            category=np.concatenate([self.user_history.category, prepared.category]),
+            type=np.concatenate([self.user_history.type, prepared.type])
+        )
+        window = slice(-self.incremental_window, None)
+        window_amounts = history.amount[window]
 
-    def predict(self, new_transaction_df):
+        # Yeni ağaçlar eskilerle aynı örnek boyutuyla (max_samples_) eğitilmeli,
+        # yoksa yol uzunlukları farklı normalize edilir. Küçük geçmişlerde (<256
+        # gider) bu, tam eğitimdeki satır sayısıdır; pencere en az o kadar satır
+        # içerdiği için yeni ağaçlar pencereden aynı boyutta örnek çeker.
+        if len(window_amounts) < self.model.max_samples_:
+            return None
+        if self._window_drift(window_amounts) > self.drift_threshold:
+            return None
+
+        window_codes = np.fromiter((self.category_codes[c] for c in history.category[window]), dtype=np.int64, count=len(window_amounts))
+        X_window = self._feature_matrix(window_amounts, history.day_of_week[window], window_codes)
+
+        grown = copy.copy(self)
+        grown.model = copy.copy(self.model)
+        grown.category_stats = {c: RunningStats(st.count, st.mean, st.m2) for c, st in self.category_stats.items()}
+        for category, amount in zip(prepared.category, prepared.amount):
+            grown.update_stats(category, amount)
+
+        forest = grown.model
+        n_trees = forest.n_estimators
+        n_replaced = min(n_trees, math.ceil(n_new * n_trees / len(window_amounts)))
+        # En eski ağaçları bırak (dilimleme yeni listeler üretir, eski model etkilenmez)
+        forest.estimators_ = forest.estimators_[n_replaced:]
+        forest.estimators_features_ = forest.estimators_features_[n_replaced:]
+        grown.growth_steps = self.growth_steps + 1
+        forest.random_state = self.random_state + grown.growth_steps
+        forest.max_samples = self.model.max_samples_
+        forest.warm_start = True
+        forest.fit(X_window)
+        forest.warm_start = False
+        forest.max_samples = self.model.max_samples
+
+        grown.user_history = history
+        grown.rows_since_full_fit = rows_since_full_fit
+        print(f"Model artımlı olarak büyütüldü: {n_new} yeni işlem, {n_replaced} ağaç yenilendi.")
+        return grown
+
+    def _build_category_stats(self, amounts, codes):
+        """Tüm kategorilerin RunningStats değerlerini tek geçişte (bincount) hesaplar."""
+        counts = np.bincount(codes)
+        means = np.bincount(codes, weights=amounts) / counts
+        m2 = np.bincount(codes, weights=(amounts - means[codes]) ** 2)
+        return {
+            category: RunningStats(int(counts[code]), float(means[code]), float(m2[code]))
+            for category, code in self.category_codes.items()
+        }
+
+    def update_stats(self, category, amount):
         """
-        Eğitilmiş modeli kullanarak yeni bir işlemin anomali olup olmadığını tahmin eder.
+        Yeni bir gider işlemini, modeli yeniden eğitmeden kategori
+        istatistiklerine ekler.
         """
+        stats = self.category_stats.get(category)
+        if stats is None:
+            stats = self.category_stats[category] = RunningStats()
+        stats.update(float(amount))
+
+    def predict(self, new_transaction):
+        """
+        Eğitilmiş modeli kullanarak yeni bir işlemin (dict) anomali olup olmadığını tahmin eder.
+        """
+        return self.predict_batch(new_transaction)[0]
+
+    def _rule_thresholds(self, codes):
+        """
+        Her işlem için kategorisinin (ortalama, 3-sigma eşiği) değerlerini döndürür.
+        Yeterli geçmişi (5'ten fazla) olmayan kategoriler için eşik NaN'dır.
+        """
+        unique_codes, inverse = np.unique(codes, return_inverse=True)
+        means = np.zeros(len(unique_codes))
+        thresholds = np.full(len(unique_codes), np.nan)
+        for j, code in enumerate(unique_codes):
+            category_stats = self.category_stats.get(self.category_encoder.classes_[code])
+            if category_stats is not None and category_stats.count > 5:
+                means[j] = category_stats.mean
+                outlier_threshold = category_stats.outlier_threshold(3)
+                if outlier_threshold is not None:
+                    thresholds[j] = outlier_threshold
+        return means[inverse], thresholds[inverse]
+
+    def predict_batch(self, new_transactions):
+        """
+        Birden fazla yeni işlemi tek seferde tahmin eder.
+        IsolationForest tek bir 'decision_function' çağrısıyla, 3-sigma kuralı da
+        vektörel olarak uygulanır. Girdi sırasıyla (is_anomaly, message, score)
+        listesi döndürür. score IsolationForest skorudur (toplu taramadaki gibi
+        düşük = daha anormal); model çalışmadıysa None'dır.
+        """
+        new_transactions = _as_records(new_transactions)
+        results = [None] * len(new_transactions)
+
+        # Gelen yeni işlemleri de aynı özellik hazırlamadan geçir
+        prepared = prepare_features(new_transactions)
         
-        # Gelen yeni işlemi de aynı _prepare_data'dan geçir
-        new_transaction_df = self._prepare_data(new_transaction_df)
-        
-        # Gelen işlemde veri hatası varsa (örn: tarih okunamadı)
-        if new_transaction_df.empty:
-            return (False, "Yeni işlem verisi işlenemedi (örn: tarih formatı bozuk).")
+        # Veri hatası olan işlemler (örn: tarih okunamadı) hazırlama sırasında atılır
+        is_valid = np.zeros(len(new_transactions), dtype=bool)
+        is_valid[prepared.index] = True
+        for i in np.flatnonzero(~is_valid):
+            results[i] = (False, "Yeni işlem verisi işlenemedi (örn: tarih formatı bozuk).", None)
         
-        # Yeni işlem bir GİDER değilse, kontrol etme
-        if new_transaction_df['type'].iloc[0].lower() != 'expense':
-            return (False, "✅ Bu bir gelir işlemi, anomali kontrolü yapılmadı.")
+        # GİDER olmayan işlemler kontrol edilmez
+        is_expense = prepared.type == 'expense'
+        for i in prepared.index[~is_expense]:
+            results[i] = (False, "✅ Bu bir gelir işlemi, anomali kontrolü yapılmadı.", None)
+        positions = prepared.index[is_expense]
 
         # Model eğitilemediyse (yetersiz veri), her işlemi normal kabul et
         if not self.is_fitted:
-            return (False, "Yeterli geçmiş veri olmadığı için harcama normal kabul edildi.")
-            
-        category_name = new_transaction_df['category'].iloc[0]
-        amount = new_transaction_df['amount'].iloc[0]
+            for i in positions:
+                results[i] = (False, "Yeterli geçmiş veri olmadığı için harcama normal kabul edildi.", None)
+            return results
+
+        categories = prepared.category[is_expense]
+        amounts = prepared.amount[is_expense]
+        days = prepared.day_of_week[is_expense]
 
         # Kural 1: Yeni Kategori Kontrolü
-        try:
-            # Bu kategoriyi daha önce gördük mü? Encoder'a sor.
-            encoded_val = self.category_encoder.transform([category_name])
-            new_transaction_df['category_encoded'] = encoded_val
-        except ValueError:
-            # Hata alırsak, bu yeni bir kategoridir. Bu bir anomalidir.
-            return (True, f"🚨 ANOMALİ TESPİT EDİLDİ! '{category_name}' kategorisinde daha önce hiç harcama yapmamıştınız.")
+        # Bu kategoriyi daha önce gördük mü? Encoder'ın sınıflarına bak.
+        codes = np.fromiter((self.category_codes.get(c, -1) for c in categories), dtype=np.int64, count=len(categories))
+        is_known_category = codes >= 0
+        for i, category_name in zip(positions[~is_known_category], categories[~is_known_category]):
+            results[i] = (True, f"🚨 ANOMALİ TESPİT EDİLDİ! '{category_name}' kategorisinde daha önce hiç harcama yapmamıştınız.", None)
+
+        if not is_known_category.any():
+            return results
+        positions, categories = positions[is_known_category], categories[is_known_category]
+        amounts, days, codes = amounts[is_known_category], days[is_known_category], codes[is_known_category]
 
         # Kural 2: Model Tahmini (Isolation Forest)
-        # model.predict() -> -1 anormal, 1 normal demektir.
-        is_anomaly_by_model = (self.model.predict(new_transaction_df[self.features])[0] == -1)
+        # model.predict() skor < 0 olanları -1 (anormal) sayar; skor kaydedildiği için aynı eşik burada uygulanır
+        scores = self.model.decision_function(self._feature_matrix(amounts, days, codes))
+        is_anomaly_by_model = scores < 0
 
         # Kural 3: İstatistiksel Kural (Aşırı Yüksek Harcama)
-        is_anomaly_by_rule = False
-        mean_amount = 0.0
-        
-        # Bu kategorideki geçmiş harcamaları bul
-        category_history = self.user_history[self.user_history['category'] == category_name]
-        
-        # Yeterli geçmiş varsa (örn: 5'ten fazla) istatistiksel olarak bak
-        if len(category_history) > 5:
-            mean_amount = category_history['amount'].mean()
-            std_amount = category_history['amount'].std()
-            
-            if pd.notna(std_amount) and std_amount > 0:
-                # 3-sigma kuralı (Ortalamanın 3 standart sapma üzeri)
-                outlier_threshold = mean_amount + (3 * std_amount)
-                if amount > outlier_threshold:
-                    is_anomaly_by_rule = True
-        
+        # 3-sigma kuralı (Ortalamanın 3 standart sapma üzeri); eşik NaN ise kural uygulanmaz
+        mean_amounts, outlier_thresholds = self._rule_thresholds(codes)
+        is_anomaly_by_rule = amounts > outlier_thresholds
+
         # Sonuç
-        if is_anomaly_by_model or is_anomaly_by_rule:
-            if is_anomaly_by_rule:
-                 return (True, f"🚨 ANORMAL BİR HARCAMA TESPİT EDİLDİ! '{category_name}' kategorisindeki {amount:.2f} TL harcamanız, bu kategorideki ortalama harcamanızın ({mean_amount:.2f} TL) çok üzerinde.")
+        for pos, i in enumerate(positions):
+            category_name = categories[pos]
+            amount = amounts[pos]
+            score = float(scores[pos])
+            if is_anomaly_by_rule[pos]:
+                results[i] = (True, f"🚨 ANORMAL BİR HARCAMA TESPİT EDİLDİ! '{category_name}' kategorisindeki {amount:.2f} TL harcamanız, bu kategorideki ortalama harcamanızın ({mean_amounts[pos]:.2f} TL) çok üzerinde.", score)
+            elif is_anomaly_by_model[pos]:
+                results[i] = (True, f"🚨 ANORMAL BİR HARCAMA TESPİT EDİLDİ! '{category_name}' kategorisindeki {amount:.2f} TL tutarındaki harcama, genel harcama alışkanlıklarınızın dışında görünüyor.", score)
             else:
-                 return (True, f"🚨 ANORMAL BİR HARCAMA TESPİT EDİLDİ! '{category_name}' kategorisindeki {amount:.2f} TL tutarındaki harcama, genel harcama alışkanlıklarınızın dışında görünüyor.")
-        else:
-            return (False, "✅ Bu harcama normal görünüyor.")
+                results[i] = (False, "✅ Bu harcama normal görünüyor.", score)
+        return results
+
+# --------------------------------------------------------------------
+# 3. 'ModelRegistry' SINIFI
+# Kullanıcı başına geçmişi, geçmiş sürümünü ve eğitilmiş modeli
+# (IsolationForest + LabelEncoder + geçmiş istatistikleri) bellekte
+# tutar. Geçmiş değişmediği sürece aynı model istekler arasında
+# yeniden kullanılır.
+# --------------------------------------------------------------------
+class HistoryVersionMismatch(Exception):
+    """
+    server_api'nin delta gönderdiği temel sürüm, bizdeki sürümle
+    eşleşmiyor (ya da kullanıcının geçmişi hiç yok). Tam senkronizasyon gerekir.
+    """
+    def __init__(self, current_version=None):
+        super().__init__("Geçmiş sürümü uyuşmuyor, tam senkronizasyon gerekli.")
+        self.current_version = current_version
+
+
+class UserModelEntry:
+    __slots__ = ('history_version', 'history', 'model')
+
+    def __init__(self, history_version, history, model):
+        self.history_version = history_version
+        self.history = history  # işlem id'si -> işlem kaydı (dict)
+        self.model = model
+
+
+class ModelRegistry:
+    def __init__(self, max_users=1000):
+        """
+        max_users: Bellekte tutulacak en fazla kullanıcı modeli sayısı.
+        Sınır aşılınca en uzun süredir kullanılmayan (LRU) model atılır.
+        """
+        self.max_users = max_users
+        self._entries = OrderedDict()  # user_id -> UserModelEntry
+        self._lock = threading.Lock()
+        self._fit_locks = {}  # Aynı kullanıcı için eşzamanlı çift eğitimi önler
+
+    def get(self, user_id):
+        """Kullanıcının kayıtlı girdisini döndürür, yoksa None."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+            return entry
+
+    def put(self, user_id, entry):
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                evicted_user_id, _ = self._entries.popitem(last=False)
+                self._fit_locks.pop(evicted_user_id, None)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def fit_lock(self, user_id):
+        with self._lock:
+            return self._fit_locks.setdefault(user_id, threading.Lock())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+def compute_history_version(user_history_list):
+    """
+    server_api bir 'history_version' göndermezse kullanılan yedek sürüm:
+    geçmiş listesinin içeriğinden üretilen kısa bir hash.
+    """
+    raw = json.dumps(user_history_list, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def compute_delta_version(base_version, history_delta):
+    """Delta uygulandıktan sonraki sürüm: temel sürüm + delta içeriğinin hash'i."""
+    raw = base_version + json.dumps(history_delta, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _is_expense(record):
+    return str(record.get('type', '')).lower() == 'expense'
+
+
+# --------------------------------------------------------------------
+# 4. 'ModelFitPool' SINIFI
+# IsolationForest eğitimini Flask istek thread'inden alıp sınırlı bir
+# süreç havuzunda çalıştırır. İstek thread'i sadece sonucu bekler;
+# aynı anda gelen eğitimler GIL için yarışmaz, çekirdeklere yayılır.
+# Küçük geçmişler (süreçler arası kopyalama eğitimden pahalı olduğu
+# için) aynı thread'de eğitilir.
+# --------------------------------------------------------------------
+class ModelFitBusy(RuntimeError):
+    """Eğitim kuyruğu dolu; istemci daha sonra tekrar denemeli."""
+
+
+def _fit_user_model(user_history_list):
+    # Süreç havuzunda çalışır, bu yüzden modül seviyesinde (pickle edilebilir) olmalı
+    anomaly_model = UserAnomalyModel()
+    # (fit metodu kendi içinde 'expense' filtresi yapıyor)
+    anomaly_model.fit(user_history_list)
+    return anomaly_model
+
+
+class ModelFitPool:
+    def __init__(self, max_workers=None, max_pending=None, min_history=None, queue_timeout=None):
+        """
+        max_workers:   eğitim süreci sayısı (0 ise havuz kullanılmaz)
+        max_pending:   aynı anda çalışan + sırada bekleyen en fazla eğitim
+        min_history:   havuza gönderilecek en küçük geçmiş boyutu
+        queue_timeout: kuyruk doluyken yer açılması için beklenecek saniye
+        """
+        if max_workers is None:
+            max_workers = int(os.getenv('ANOMALY_FIT_WORKERS', str(min(4, os.cpu_count() or 1))))
+        if max_pending is None:
+            max_pending = int(os.getenv('ANOMALY_FIT_QUEUE_LIMIT', str(max(1, max_workers) * 2)))
+        if min_history is None:
+            min_history = int(os.getenv('ANOMALY_FIT_POOL_MIN_HISTORY', '200'))
+        if queue_timeout is None:
+            queue_timeout = float(os.getenv('ANOMALY_FIT_QUEUE_TIMEOUT', '5'))
+
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers, 1)
+        self.min_history = min_history
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Havuz ilk büyük eğitimde oluşturulur (import sırasında süreç açılmaz)
+        with self._lock:
+            if self._executor is None:
+                # spawn: fork kopyası, sunucunun thread'lerini ve tutulan kilitlerini
+                # (Flask, server_api içinde torch/SQLAlchemy) devralıp kilitlenebilir
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+                print(f"Model eğitim havuzu başlatıldı ({self.max_workers} süreç, kuyruk: {self.max_pending}).")
+            return self._executor
+
+    def _reset_executor(self, broken_executor):
+        with self._lock:
+            if self._executor is broken_executor:
+                self._executor = None
+
+    def fit(self, user_history_list):
+        """Eğitilmiş bir UserAnomalyModel döndürür; kuyruk doluysa ModelFitBusy fırlatır."""
+        if self.max_workers <= 0 or len(user_history_list) < self.min_history:
+            return _fit_user_model(user_history_list)
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise ModelFitBusy("Model eğitim kuyruğu dolu, lütfen daha sonra tekrar deneyin.")
+        try:
+            executor = self._get_executor()
+            try:
+                return executor.submit(_fit_user_model, user_history_list).result()
+            except BrokenProcessPool:
+                # Bir eğitim süreci öldü (örn: bellek yetersiz): havuzu yenile, bu isteği burada eğit
+                print("Uyarı: Model eğitim havuzu bozuldu, yeniden oluşturulacak.")
+                self._reset_executor(executor)
+                return _fit_user_model(user_history_list)
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
 
 # --------------------------------------------------------------------
-# 2. 'AnomalyDetectionService' SINIFI
-# Bu sınıf, route katmanıyla konuşan ve her istekte 
-# yeni bir UserAnomalyModel oluşturan sarmalayıcıdır.
+# 5. 'AnomalyDetectionService' SINIFI
+# Bu sınıf, route katmanıyla konuşan sarmalayıcıdır. Kullanıcının
+# modelini kayıt defterinden alır; geçmiş değiştiyse yeniden eğitir.
+# Geçmiş ya tamamen ('user_history') ya da son sürümden bu yana
+# değişen işlemler olarak ('history_delta') gönderilebilir.
 # --------------------------------------------------------------------
 class AnomalyDetectionService:
-    def __init__(self):
+    def __init__(self, max_cached_users=None, fit_pool=None):
         """
-        Bu servisin __init__'i boştur. Model, eğitilmiş dosyaları
-        (model.joblib ve encoder.joblib) KULLANMAZ.
-        Her kullanıcı için anlık olarak YENİDEN EĞİTİLİR (fit edilir).
+        Model, eğitilmiş dosyaları (model.joblib ve encoder.joblib) KULLANMAZ.
+        Her kullanıcı için geçmişinden eğitilir ('ModelFitPool' üzerinde) ve
+        geçmiş değişene kadar 'ModelRegistry' içinde saklanır.
         """
-        print("AnomalyDetectionService (Anlık Eğitim) başlatıldı.")
-        
-    def check_transaction(self, user_history_list, new_transaction_dict):
+        if max_cached_users is None:
+            max_cached_users = int(os.getenv('ANOMALY_REGISTRY_MAX_USERS', '1000'))
+        self.registry = ModelRegistry(max_users=max_cached_users)
+        self.fit_pool = fit_pool or ModelFitPool()
+        print("AnomalyDetectionService (Model Kayıt Defteri) başlatıldı.")
+
+    def _validate_records(self, records, field_name):
+        if not isinstance(records, list) or not all(isinstance(r, dict) for r in records):
+            print(f"Veri dönüştürme hatası: '{field_name}' bir işlem listesi değil.")
+            raise ValueError(f"Gelen '{field_name}' verisi bozuk.")
+        return records
+
+    def _fit_new_model(self, user_history_list):
+        self._validate_records(user_history_list, 'user_history')
+        return self.fit_pool.fit(user_history_list)
+
+    def _index_history(self, user_history_list):
+        """Geçmişi işlem id'sine göre indeksler (id yoksa sıra numarası kullanılır)."""
+        return {
+            str(record.get('id', f"_{i}")): record
+            for i, record in enumerate(user_history_list)
+        }
+
+    def get_model(self, user_id, user_history_list=None, history_version=None, history_delta=None):
+        """
+        Kullanıcının güncel modelini ve geçmiş sürümünü döndürür: (model, history_version).
+        Kayıtlı modelin sürümü geçmişle eşleşiyorsa yeniden eğitim yapılmaz.
+
+        history_delta verilirse kayıtlı geçmişe uygulanır:
+        {"base_version": "...", "upserts": [{"id": ..., ...}], "deletes": ["id", ...]}
+        Temel sürüm eşleşmezse HistoryVersionMismatch fırlatılır.
+        """
+        if history_delta is not None:
+            if user_id is None:
+                raise ValueError("'history_delta' için kullanıcı kimliği gereklidir.")
+            return self._apply_history_delta(user_id, history_delta)
+
+        if user_history_list is None:
+            raise ValueError("'user_history' veya 'history_delta' gereklidir.")
+
+        if user_id is None:
+            return self._fit_new_model(user_history_list), None
+
+        if history_version is None:
+            history_version = compute_history_version(user_history_list)
+
+        entry = self.registry.get(user_id)
+        if entry is not None and entry.history_version == history_version:
+            return entry.model, history_version
+
+        with self.registry.fit_lock(user_id):
+            # Kilidi beklerken başka bir istek aynı sürümü eğitmiş olabilir
+            entry = self.registry.get(user_id)
+            if entry is None or entry.history_version != history_version:
+                entry = UserModelEntry(
+                    history_version,
+                    self._index_history(user_history_list),
+                    self._fit_new_model(user_history_list)
+                )
+                self.registry.put(user_id, entry)
+        return entry.model, history_version
+
+    def _apply_history_delta(self, user_id, history_delta):
+        base_version = history_delta.get('base_version')
+        upserts = history_delta.get('upserts') or []
+        deletes = history_delta.get('deletes') or []
+
+        with self.registry.fit_lock(user_id):
+            entry = self.registry.get(user_id)
+            if entry is None or entry.history_version != base_version:
+                raise HistoryVersionMismatch(entry.history_version if entry else None)
+
+            if not upserts and not deletes:
+                return entry.model, entry.history_version
+
+            history = dict(entry.history)
+            expenses_changed = False
+            # Yeni eklenen giderler (silme/değiştirme yoksa artımlı büyütme için)
+            appended_expenses = []
+            only_appended = True
+            for transaction_id in deletes:
+                removed = history.pop(str(transaction_id), None)
+                if removed is not None and _is_expense(removed):
+                    expenses_changed = True
+                    only_appended = False
+            for record in upserts:
+                if 'id' not in record:
+                    raise ValueError("'history_delta.upserts' içindeki her işlemin bir 'id' alanı olmalıdır.")
+                transaction_id = str(record['id'])
+                previous = history.get(transaction_id)
+                history[transaction_id] = record
+                if _is_expense(record) or (previous is not None and _is_expense(previous)):
+                    expenses_changed = True
+                    if previous is None:
+                        appended_expenses.append(record)
+                    else:
+                        only_appended = False
+
+            # Model sadece gider işlemleriyle eğitilir; gelir değişiklikleri yeniden eğitim gerektirmez.
+            # Sadece yeni gider eklendiyse model artımlı büyütülür, aksi halde tam eğitim yapılır.
+            model = entry.model
+            if expenses_changed:
+                model = entry.model.grow(appended_expenses) if only_appended else None
+                if model is None:
+                    model = self._fit_new_model(list(history.values()))
+            new_entry = UserModelEntry(compute_delta_version(base_version, history_delta), history, model)
+            self.registry.put(user_id, new_entry)
+            return new_entry.model, new_entry.history_version
+
+    def check_transaction(self, user_history_list, new_transaction_dict, user_id=None, history_version=None, history_delta=None):
         """
         Ana API fonksiyonu.
         1. Ham JSON verilerini alır.
-        2. DataFrame'e dönüştürür.
-        3. Kullanıcıya özel modeli eğitir.
-        4. Yeni işlemi tahmin eder.
+        2. Kullanıcıya özel modeli kayıt defterinden alır (geçmiş
+           değiştiyse yeniden eğitir).
+        3. Yeni işlemi tahmin eder.
+
+        user_id verilmezse model saklanmaz ve her çağrıda yeniden eğitilir.
+        (is_anomaly, message, score, history_version) döndürür.
         """
         
-        # 1. Gelen JSON listelerini Pandas DataFrame'e dönüştür
-        try:
-            history_df = pd.DataFrame.from_records(user_history_list)
-            new_transaction_df = pd.DataFrame.from_records([new_transaction_dict])
-        except Exception as e:
-            print(f"DataFrame dönüştürme hatası: {e}")
-            raise ValueError("Gelen 'user_history' veya 'new_transaction' verisi bozuk.")
+        # 1. Yeni işlemi doğrula
+        self._validate_records([new_transaction_dict], 'new_transaction')
+
+        # 2. Kullanıcının modelini al (geçmiş değiştiyse yeniden eğitilir)
+        anomaly_model, history_version = self.get_model(user_id, user_history_list, history_version, history_delta)
 
-        # 2. Her istek için yeni bir model nesnesi oluştur
-        anomaly_model = UserAnomalyModel()
+        # 3. Yeni işlemi tahmin et ve sonucu (tuple olarak) döndür
+        is_anomaly, message, score = anomaly_model.predict(new_transaction_dict)
+        return is_anomaly, message, score, history_version
 
-        # 3. Modeli kullanıcının geçmişiyle eğit
-        # (fit metodu kendi içinde 'expense' filtresi yapıyor)
-        anomaly_model.fit(history_df)
+    def check_batch(self, user_history_list, new_transaction_list, user_id=None, history_version=None, history_delta=None):
+        """
+        Toplu API fonksiyonu (içe aktarma, geçmiş doldurma, çevrimdışı senkronizasyon).
+        Model bir kez alınır/eğitilir ve tüm yeni işlemler tek seferde tahmin edilir.
+        Girdi sırasıyla (is_anomaly, message, score) listesi ve geçmiş sürümünü döndürür.
+        """
+        anomaly_model, history_version = self.get_model(user_id, user_history_list, history_version, history_delta)
+        if not new_transaction_list:
+            return [], history_version
 
-        # 4. Yeni işlemi tahmin et ve sonucu (tuple olarak) döndür
-        return anomaly_model.predict(new_transaction_df)
+        self._validate_records(new_transaction_list, 'new_transactions')
+        return anomaly_model.predict_batch(new_transaction_list), history_version
 
 # ====================================================================
 # BU EN ÖNEMLİ KISIM:
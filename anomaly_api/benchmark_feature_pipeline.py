@@ -0,0 +1,97 @@
+# benchmark_feature_pipeline.py
+# NumPy özellik hazırlama yolunu (prepare_features) eski pandas yoluyla
+# (DataFrame + pd.to_datetime + dropna) farklı geçmiş boyutlarında karşılaştırır.
+#
+# Kullanım: python anomaly_api/benchmark_feature_pipeline.py [--repeat 20]
+
+import argparse
+import datetime
+import importlib.util
+import os
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+SERVICE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'services', 'anomaly_detection_service.py')
+HISTORY_SIZES = [10, 100, 1000, 10000]
+CATEGORIES = ['Market', 'Yiyecek', 'Ulaşım', 'Fatura', 'Eğlence']
+
+
+def load_service_module():
+    # Flask uygulamasını (ve config'i) yüklemeden sadece servis modülünü al
+    spec = importlib.util.spec_from_file_location('anomaly_detection_service', SERVICE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def pandas_prepare(records, expense_only=False):
+    """Eski '_prepare_data' yolu (referans)."""
+    df = pd.DataFrame.from_records(records)
+    if expense_only:
+        df = df[df['type'].str.lower() == 'expense']
+    df = df.copy()
+    df['date'] = pd.to_datetime(df['date'], errors='coerce')
+    df['day_of_week'] = df['date'].dt.dayofweek
+    df = df.dropna(subset=['date', 'day_of_week', 'amount', 'category'])
+    return df['amount'].to_numpy(dtype=float), df['day_of_week'].to_numpy(dtype=np.int64), df['category'].to_numpy()
+
+
+def make_records(n, seed=42):
+    rng = random.Random(seed)
+    start = datetime.date(2024, 1, 1)
+    return [
+        {
+            "id": i,
+            "date": (start + datetime.timedelta(days=rng.randint(0, 365))).isoformat(),
+            "amount": round(rng.lognormvariate(4, 0.6), 2),
+            "type": rng.choice(['expense', 'expense', 'expense', 'income']),
+            "category": rng.choice(CATEGORIES)
+        }
+        for i in range(n)
+    ]
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    service = load_service_module()
+    new_transaction = {"date": "2024-06-01", "amount": 120.0, "type": "expense", "category": "Market"}
+
+    print(f"{'geçmiş':>8} | {'pandas ms':>10} | {'numpy ms':>10} | {'hız':>6} | aynı")
+    for n in HISTORY_SIZES:
+        records = make_records(n)
+
+        expected = pandas_prepare(records, expense_only=True)
+        prepared = service.prepare_features(records, expense_only=True)
+        identical = (
+            np.array_equal(expected[0], prepared.amount)
+            and np.array_equal(expected[1], prepared.day_of_week)
+            and list(expected[2]) == list(prepared.category)
+        )
+
+        pandas_ms = best_of(lambda: pandas_prepare(records, expense_only=True), args.repeat)
+        numpy_ms = best_of(lambda: service.prepare_features(records, expense_only=True), args.repeat)
+        print(f"{n:>8} | {pandas_ms:>10.3f} | {numpy_ms:>10.3f} | {pandas_ms / numpy_ms:>5.1f}x | {identical}")
+
+    # Tek işlemlik istek: yeni işlemin hazırlanması
+    pandas_ms = best_of(lambda: pandas_prepare([new_transaction]), args.repeat)
+    numpy_ms = best_of(lambda: service.prepare_features([new_transaction]), args.repeat)
+    print(f"{'1 (yeni)':>8} | {pandas_ms:>10.3f} | {numpy_ms:>10.3f} | {pandas_ms / numpy_ms:>5.1f}x |")
+
+
+if __name__ == '__main__':
+    main()
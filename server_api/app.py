@@ -72,6 +72,9 @@ from models.transaction_model import UserTransaction
 from models.insight_model import Insight
 from models.recurring_transaction_model import RecurringTransaction
 from models.two_factor_session_model import TwoFactorSession
+from models.transaction_anomaly_model import TransactionAnomaly
+from models.data_version_model import DataVersion
+from models.ai_result_model import BudgetAnalysisResult
 
 def insert_default_categories():
     """Insert default categories if the categories table is empty."""
@@ -143,6 +146,52 @@ def init_db():
     print("Database initialization completed!")
 
 
+@app.cli.command()
+@click.option('--workers', type=int, default=None, help='Scoring processes (default: CPU count).')
+@click.option('--yield-per', type=int, default=1000, help='Rows fetched per round trip from the DB cursor.')
+@click.option('--flush-users', type=int, default=50, help='Users scored between bulk writes / checkpoints.')
+@click.option('--checkpoint', default=None, help='Checkpoint file (default: ANOMALY_RESCORE_CHECKPOINT).')
+@click.option('--restart', is_flag=True, help='Ignore an existing checkpoint and start from the first user.')
+def rescore_anomalies(workers, yield_per, flush_users, checkpoint, restart):
+    """Re-score every user's transactions and store the anomaly verdicts."""
+    from services.anomaly_rescore_service import AnomalyRescoreJob, ANOMALY_RESCORE_CHECKPOINT
+    job = AnomalyRescoreJob(
+        workers=workers,
+        yield_per=yield_per,
+        flush_users=flush_users,
+        checkpoint_path=checkpoint or ANOMALY_RESCORE_CHECKPOINT
+    )
+    with app.app_context():
+        summary = job.run(restart=restart)
+    print(f"Rescore completed: {summary['users']} users, {summary['transactions']} transactions, "
+          f"{summary['anomalies']} anomalies, {summary['failed_users']} failed users "
+          f"in {summary['elapsed_seconds']}s ({summary['users_per_second']} users/s, "
+          f"{summary['transactions_per_second']} transactions/s)")
+
+
+@app.cli.command()
+def train_shared_model():
+    """Train the shared budget model used when AI_MODEL_MODE=shared."""
+    with app.app_context():
+        users = ai_service.train_shared()
+    print(f"Shared model trained on {users} users.")
+
+
+@app.cli.command()
+@click.option('--workers', type=int, default=None, help='Training processes (default: CPU count).')
+@click.option('--batch-size', type=int, default=None, help='Users whose features are stacked per batch (default: workers).')
+@click.option('--limit', type=int, default=None, help='Train at most this many stale users.')
+def train_budget_models(workers, batch_size, limit):
+    """Retrain the budget models of users whose data changed since their last training (run nightly)."""
+    from services.budget_training_service import BudgetTrainingJob
+    job = BudgetTrainingJob(ai_service, workers=workers, batch_size=batch_size, limit=limit)
+    with app.app_context():
+        summary = job.run()
+    print(f"Training completed: {summary['checked']} users checked, {summary['stale']} stale, "
+          f"{summary['trained']} trained, {summary['failed']} failed "
+          f"in {summary['elapsed_seconds']}s ({summary['users_per_second']} users/s)")
+
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
@@ -0,0 +1,89 @@
+# benchmark_budget_inference.py
+# Per-analysis model latency (p50 / p99) of the budget model inference paths:
+#   eager (reload)  - the old prompt path: new BudgetHybridModel + torch.load every call
+#   eager (cached)  - eager model kept in memory
+#   torchscript     - frozen TorchScript copy kept in memory (current default)
+# Batch sizes > 1 correspond to the shared model's cross-user batches.
+#
+# Usage: python server_api/benchmark_budget_inference.py [--iterations 2000] [--batch-sizes 1 16]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.ai_anomaly_service import BudgetHybridModel  # noqa: E402
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2] * 1000, timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+
+
+def measure(run, x_seq, x_static, iterations, warmup=20):
+    with torch.no_grad():
+        for _ in range(warmup):
+            run(x_seq, x_static)
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            run(x_seq, x_static)
+            timings.append(time.perf_counter() - started)
+    return percentiles(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16])
+    args = parser.parse_args()
+
+    torch.manual_seed(42)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        state_path = os.path.join(tmp_dir, 'model.pth')
+        script_path = os.path.join(tmp_dir, 'model.pt')
+
+        model = BudgetHybridModel().eval()
+        torch.save(model.state_dict(), state_path)
+        torch.jit.save(torch.jit.freeze(torch.jit.script(model)), script_path)
+        scripted = torch.jit.load(script_path)
+
+        def eager_reload(x_seq, x_static):
+            fresh = BudgetHybridModel()
+            fresh.load_state_dict(torch.load(state_path))
+            fresh.eval()
+            return fresh(x_seq, x_static)
+
+        paths = [
+            ('eager (reload)', eager_reload),
+            ('eager (cached)', model),
+            ('torchscript', scripted),
+        ]
+
+        print(f"{'path':<16} | {'batch':>5} | {'p50 ms':>8} | {'p99 ms':>8} | {'p50 vs reload':>13}")
+        for batch_size in args.batch_sizes:
+            x_seq = torch.rand(batch_size, 6, 3) * 10000
+            x_static = torch.randn(batch_size, 8)
+
+            with torch.no_grad():
+                expected = model(x_seq, x_static)
+                actual = scripted(x_seq, x_static)
+            max_diff = max(float((e - a).abs().max()) for e, a in zip(expected, actual))
+
+            baseline = None
+            for name, run in paths:
+                # Reloading from disk is slow; fewer iterations keep the run short
+                iterations = max(50, args.iterations // 10) if run is eager_reload else args.iterations
+                p50, p99 = measure(run, x_seq, x_static, iterations)
+                baseline = baseline or p50
+                print(f"{name:<16} | {batch_size:>5} | {p50:>8.3f} | {p99:>8.3f} | {baseline / p50:>12.1f}x")
+            print(f"{'':<16} | {batch_size:>5} | torchscript max |diff| vs eager: {max_diff:.2e}")
+
+
+if __name__ == '__main__':
+    main()
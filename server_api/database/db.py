@@ -1,2 +1,13 @@
 from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
\ No newline at end of file
+from sqlalchemy.dialects import postgresql, sqlite
+
+db = SQLAlchemy()
+
+
+def upsert_insert(model, session=None):
+    """
+    INSERT statement supporting on_conflict_do_update / on_conflict_do_nothing
+    for the session's database (PostgreSQL; SQLite for local databases).
+    """
+    bind = (session or db.session).get_bind()
+    return (sqlite if bind.dialect.name == 'sqlite' else postgresql).insert(model)
@@ -0,0 +1,23 @@
+from database.db import db
+from datetime import datetime
+
+
+class BudgetAnalysisResult(db.Model):
+    """
+    AIService bütçe analizi sonucu (hedef başına bir satır).
+    AI_RESULT_STORE=database iken sonuç deposu olarak kullanılır, böylece
+    tüm sunucu süreçleri aynı sonucu görür.
+    """
+    __tablename__ = 'budget_analysis_results'
+
+    goal_id = db.Column(db.String, db.ForeignKey('goals.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    # Sonucun hesaplandığı veri ve model sürümleri (JSON); değiştiyse sonuç geçersizdir
+    versions = db.Column(db.Text, nullable=False)
+    # Analiz sonucu (JSON)
+    result = db.Column(db.Text, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # En son okunma zamanı; LRU tahliyesi bu sütuna göre yapılır
+    accessed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
@@ -0,0 +1,18 @@
+from database.db import db
+from datetime import datetime
+
+
+class DataVersion(db.Model):
+    """
+    Kullanıcı verisinin sürüm sayacı.
+    Bir kullanıcının izlenen verisi (örn: işlemleri) eklendiğinde, güncellendiğinde
+    veya silindiğinde aynı veritabanı işlemi içinde artırılır. Önbellekler sonucu
+    bu sürümle saklar; sürüm değişmediyse sonuç hala geçerlidir.
+    """
+    __tablename__ = 'data_versions'
+
+    user_id = db.Column(db.String, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    # Hangi veri kümesi: transactions, recurring, goals
+    scope = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
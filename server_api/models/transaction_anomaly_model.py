@@ -0,0 +1,47 @@
+from database.db import db
+from datetime import datetime
+
+
+class TransactionAnomaly(db.Model):
+    """
+    Bir işlemin anomali kontrolü sonucu.
+    İşlem kaydedildikten sonra 'pending' olarak oluşturulur, arka plandaki
+    kontrol bitince sonuçla güncellenir.
+    """
+    __tablename__ = 'transaction_anomalies'
+    __table_args__ = (
+        # "Sadece anomaliler" sorguları (kullanıcının işaretli işlemleri) için
+        db.Index('ix_transaction_anomalies_user_id_is_anomaly', 'user_id', 'is_anomaly'),
+    )
+
+    transaction_id = db.Column(db.String, db.ForeignKey('transactions.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.String, db.ForeignKey('users.id'), nullable=False, index=True)
+
+    # Durum: pending, done, failed
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    is_anomaly = db.Column(db.Boolean, nullable=True)
+    # Sonucun gerekçesi (kullanıcıya gösterilen açıklama)
+    message = db.Column(db.Text)
+    # Isolation Forest puanı (düşük = daha anormal); Isolation Forest çalışmadıysa (örn: gelir işlemi) boş
+    score = db.Column(db.Float, nullable=True)
+    # Sonucu üreten: realtime (işlem eklenince) veya batch (POST /anomaly, rescore_anomalies komutu)
+    source = db.Column(db.String(20), default='realtime', nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    checked_at = db.Column(db.DateTime)
+
+    transaction = db.relationship(
+        'UserTransaction',
+        backref=db.backref('anomaly', uselist=False, cascade='all, delete-orphan')
+    )
+
+    def serialize(self):
+        return {
+            'transaction_id': self.transaction_id,
+            'status': self.status,
+            'is_anomaly': self.is_anomaly,
+            'message': self.message,
+            'score': self.score,
+            'source': self.source,
+            'checked_at': self.checked_at.isoformat() if self.checked_at else None
+        }
@@ -0,0 +1,86 @@
+from database.db import db, upsert_insert
+from models.transaction_anomaly_model import TransactionAnomaly
+from models.transaction_model import UserTransaction
+from datetime import datetime
+
+
+class TransactionAnomalyRepository:
+
+    @staticmethod
+    def create_pending(transaction_id, user_id, message=None):
+        # Upsert: a rescore may already have stored a batch verdict for the new transaction
+        values = {
+            "transaction_id": transaction_id,
+            "user_id": user_id,
+            "status": 'pending',
+            "is_anomaly": None,
+            "message": message,
+            "score": None,
+            "source": 'realtime',
+            "created_at": datetime.utcnow(),
+            "checked_at": None
+        }
+        statement = upsert_insert(TransactionAnomaly).values(values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[TransactionAnomaly.transaction_id],
+            set_={key: statement.excluded[key] for key in values if key not in ('transaction_id', 'created_at')}
+        )
+        db.session.execute(statement)
+        db.session.commit()
+        return db.session.get(TransactionAnomaly, transaction_id, populate_existing=True)
+
+    @staticmethod
+    def save_verdict(transaction_id, is_anomaly, message, status='done', score=None):
+        anomaly = TransactionAnomaly.query.get(transaction_id)
+        if not anomaly:
+            # İşlem kontrol bitmeden silinmiş olabilir
+            return None
+        anomaly.status = status
+        anomaly.source = 'realtime'
+        anomaly.is_anomaly = is_anomaly
+        anomaly.score = score
+        anomaly.message = message
+        anomaly.checked_at = datetime.utcnow()
+        db.session.commit()
+        return anomaly
+
+    @staticmethod
+    def get_for_user(user_id, transaction_id):
+        return TransactionAnomaly.query.filter_by(transaction_id=transaction_id, user_id=user_id).first()
+
+    @staticmethod
+    def bulk_upsert(mappings):
+        """
+        Writes many batch verdicts with one INSERT ... ON CONFLICT DO UPDATE.
+        A realtime verdict is only replaced when it is older than the batch
+        verdict; a pending realtime check keeps its row and writes its own result.
+        """
+        if not mappings:
+            return
+        statement = upsert_insert(TransactionAnomaly).values(mappings)
+        existing = TransactionAnomaly.__table__.c
+        statement = statement.on_conflict_do_update(
+            index_elements=[TransactionAnomaly.transaction_id],
+            set_={key: statement.excluded[key] for key in mappings[0] if key != 'transaction_id'},
+            # checked_at is NULL while a realtime check is pending, so the condition is not true then
+            where=(existing.source != 'realtime') | (existing.checked_at < statement.excluded.checked_at)
+        )
+        db.session.execute(statement)
+        db.session.commit()
+
+    @staticmethod
+    def get_anomalies_for_user(user_id, page=1, per_page=50):
+        """Stored anomalies of a user, newest transaction first, served from the (user_id, is_anomaly) index."""
+        query = (
+            db.session.query(TransactionAnomaly, UserTransaction)
+            .join(UserTransaction, UserTransaction.id == TransactionAnomaly.transaction_id)
+            .filter(TransactionAnomaly.user_id == user_id, TransactionAnomaly.is_anomaly.is_(True))
+        )
+        total = query.count()
+        rows = (
+            query.order_by(UserTransaction.date.desc(), UserTransaction.id)
+            .offset((page - 1) * per_page)
+            .limit(per_page)
+            .all()
+        )
+        return rows, total
@@ -1,6 +1,10 @@
 from database.db import db
+from models.data_version_model import DataVersion
 from models.transaction_model import UserTransaction, TransactionType
+from models.transaction_anomaly_model import TransactionAnomaly
+from sqlalchemy import extract, func
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, joinedload
 from datetime import datetime
 import uuid
 
@@ -10,6 +14,35 @@ class TransactionRepository:
     def get_by_user_id(user_id):
         return UserTransaction.query.filter_by(user_id=user_id).all()
 
+    @staticmethod
+    def get_by_user_id_with_anomaly(user_id, anomalies_only=False):
+        """Transactions together with their stored anomaly verdict, loaded in the same query."""
+        query = UserTransaction.query.filter_by(user_id=user_id)
+        if anomalies_only:
+            return (
+                query.join(TransactionAnomaly, TransactionAnomaly.transaction_id == UserTransaction.id)
+                .filter(TransactionAnomaly.user_id == user_id, TransactionAnomaly.is_anomaly.is_(True))
+                .options(contains_eager(UserTransaction.anomaly))
+                .all()
+            )
+        return query.options(joinedload(UserTransaction.anomaly)).all()
+
+    @staticmethod
+    def get_monthly_totals(user_id):
+        """
+        Amount sum and row count per (year, month, type), grouped in the database:
+        a handful of rows however many transactions the user has.
+        Returns (year, month, type, total, count) rows.
+        """
+        year = extract('year', UserTransaction.date)
+        month = extract('month', UserTransaction.date)
+        return (
+            db.session.query(year, month, UserTransaction.type, func.sum(UserTransaction.amount), func.count(UserTransaction.id))
+            .filter(UserTransaction.user_id == user_id)
+            .group_by(year, month, UserTransaction.type)
+            .all()
+        )
+
     @staticmethod
     def create_for_user(user_id, transaction_data):
         try:
@@ -28,6 +61,14 @@ class TransactionRepository:
             )
 
             db.session.add(transaction)
+            db.session.flush()
+            # Bu eklemenin yazıldığı veri sürümü: flush sayacı artırdı ve satır commit'e kadar kilitli,
+            # arada başka bir yazma giremez (anomali kontrolü yalnızca yeni satırı göndermek için kullanır)
+            transaction.data_version = (
+                db.session.query(DataVersion.version)
+                .filter(DataVersion.user_id == user_id, DataVersion.scope == 'transactions')
+                .scalar()
+            )
             db.session.commit()
 
             print(f"[SUCCESS] Transaction created: {transaction.id}")
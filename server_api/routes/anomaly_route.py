@@ -1,17 +1,16 @@
+import math
+
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sklearn.ensemble import IsolationForest
-import pandas as pd
-import numpy as np
-from datetime import datetime
 
-# Gerekli model import'ları (Hatayı çözmek için)
-# Lütfen bu yolların projenizdeki modellerin konumuyla eşleştiğinden emin olun.
-from models.transaction_model import TransactionType, UserTransaction
-from models.category_model import Category
+from services.anomaly_scoring_service import detect_user_anomalies
+from repositories.transaction_anomaly_repository import TransactionAnomalyRepository
 
 anomaly_bp = Blueprint('anomaly_bp', __name__, url_prefix='/anomaly')
 
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+
 
 @anomaly_bp.route('', methods=['POST'])
 @jwt_required()
@@ -19,105 +18,74 @@ def detect_anomaly():
     """
     Performs anomaly detection on the authenticated user's transaction data using Isolation Forest.
     Returns anomaly detection results for the user's transactions.
+
+    Results are cached until the user's transactions change.
+    Optional paging of the anomaly list: ?page=1&per_page=50
     """
     current_user_id = get_jwt_identity()
 
-    from services.transaction_service import TransactionService
-    transaction_service = TransactionService()
-
-    user_transactions = transaction_service.get_transactions_by_user(current_user_id)
+    result = detect_user_anomalies(current_user_id)
 
-    if not user_transactions:
+    if not result["total_transactions"]:
         return jsonify({
             "message": "No transactions found for this user",
             "anomalies": [],
             "user_id": current_user_id
         }), 200
 
-    transaction_data = []
-    # 'i' (index) değerini alabilmek için enumerate kullanıyoruz
-    for i, transaction in enumerate(user_transactions):
-        # --- DÜZELTME BAŞLANGICI ---
-
-        # 1. 'type' (Enum) nesnesini güvenle string'e çevir
-        # HATA BURADAYDI: 'TransactionType.Expense' -> 'TransactionType.expense' (küçük 'e') olarak düzeltildi
-        tx_type_obj = getattr(transaction, 'type', TransactionType.expense)
-        tx_type_str = tx_type_obj.name if isinstance(tx_type_obj, TransactionType) else str(tx_type_obj)
-
-        # 2. 'category' (Kategori nesnesi olabilir) güvenle string'e çevir
-        cat_obj = getattr(transaction, 'category', 'General')  # Varsayılan 'General'
-        cat_str = cat_obj.name if hasattr(cat_obj, 'name') and not isinstance(cat_obj, str) else str(cat_obj)
+    anomalies = result["anomalies"]
+    response = {
+        "anomalies_detected": len(anomalies),
+        "total_transactions": result["total_transactions"],
+        "anomalies": anomalies,
+        "user_id": current_user_id
+    }
 
-        # 3. 'date' (datetime) nesnesini JSON uyumlu string'e (ISO format) çevir
-        date_obj = transaction.date if hasattr(transaction, 'date') else None
-        date_str = date_obj.isoformat() if date_obj else None
+    if 'page' in request.args or 'per_page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+        if page < 1 or per_page < 1:
+            return jsonify({"error": "'page' and 'per_page' must be positive integers"}), 400
+        per_page = min(per_page, MAX_PER_PAGE)
 
-        # 4. 'id'yi güvenle al
-        tx_id = getattr(transaction, 'id', f"index_{i}")  # ID yoksa geçici index kullan
+        start = (page - 1) * per_page
+        response["anomalies"] = anomalies[start:start + per_page]
+        response["page"] = page
+        response["per_page"] = per_page
+        response["total_pages"] = math.ceil(len(anomalies) / per_page)
 
-        # --- DÜZELTME SONU ---
+    return jsonify(response)
 
-        transaction_dict = {
-            "id": tx_id,
-            "date": date_str,
-            "amount": float(getattr(transaction, 'amount', 0.0)),
-            "type": tx_type_str,
-            "category": cat_str
-        }
-        transaction_data.append(transaction_dict)
 
-    if not transaction_data:
-        return jsonify({
-            "message": "No valid transaction data found for analysis",
-            "anomalies": [],
-            "user_id": current_user_id
-        }), 200
-
-    df = pd.DataFrame(transaction_data)
-
-    # Feature engineering
-    if 'date' in df.columns and df['date'].notna().any():
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')
-        df['day_of_week'] = df['date'].dt.dayofweek.fillna(0)
-        df['day_of_month'] = df['date'].dt.day.fillna(1)
-        df['month'] = df['date'].dt.month.fillna(1)
-    else:
-        df['day_of_week'] = 0
-        df['day_of_month'] = 1
-        df['month'] = 1
-
-    # Encode categorical variables
-    df['type_encoded'] = df['type'].map({'income': 1, 'expense': 0, 'Income': 1, 'Expense': 0}).fillna(0)
-    df['category_encoded'] = df['category'].astype('category').cat.codes
-
-    feature_columns = ['amount', 'day_of_week', 'day_of_month', 'month', 'type_encoded', 'category_encoded']
-    X = df[feature_columns].values
+@anomaly_bp.route('', methods=['GET'])
+@jwt_required()
+def get_stored_anomalies():
+    """
+    Returns the user's stored anomaly verdicts (from POST /anomaly, the background
+    per-transaction check and the rescore command) without running a model.
+    Paged: ?page=1&per_page=50
+    """
+    current_user_id = get_jwt_identity()
 
-    iso_forest = IsolationForest(
-        contamination=0.1,
-        random_state=42,
-        n_estimators=100
-    )
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', DEFAULT_PER_PAGE, type=int)
+    if page < 1 or per_page < 1:
+        return jsonify({"error": "'page' and 'per_page' must be positive integers"}), 400
+    per_page = min(per_page, MAX_PER_PAGE)
 
-    anomaly_labels = iso_forest.fit_predict(X)
+    rows, total = TransactionAnomalyRepository.get_anomalies_for_user(current_user_id, page, per_page)
 
     anomalies = []
-    # 'transaction_data' listesini (içinde string'ler olan) 'anomaly_labels' ile birleştir
-    for i, is_anomaly in enumerate(anomaly_labels):
-        if is_anomaly == -1:  # -1 anomali demektir
-
-            anomalous_transaction = transaction_data[i].copy()
-            anomalous_transaction["is_anomaly"] = True
+    for anomaly, transaction in rows:
+        item = transaction.serialize()
+        item.update(anomaly.serialize())
+        anomalies.append(item)
 
-            # Gerçek transaction ID'sini 'id' anahtarından al
-            anomalous_transaction["transaction_id"] = anomalous_transaction.pop('id')
-
-            anomalies.append(anomalous_transaction)
-
-    # 'anomalies' listesi artık sadece JSON uyumlu string'ler içeriyor
     return jsonify({
-        "anomalies_detected": len(anomalies),
-        "total_transactions": len(transaction_data),
+        "anomalies_detected": total,
         "anomalies": anomalies,
+        "page": page,
+        "per_page": per_page,
+        "total_pages": math.ceil(total / per_page),
         "user_id": current_user_id
-    })
\ No newline at end of file
+    })
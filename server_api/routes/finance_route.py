@@ -1,10 +1,23 @@
 # routes/finance_route.py
 
+import os
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from services.rbac_service import require_role
 
 finance_bp = Blueprint('finance_bp', __name__, url_prefix='/finance')
 
+# Seconds a client is asked to wait (Retry-After) when the analysis queue is full
+# or the shared model is still being trained
+AI_QUEUE_RETRY_AFTER = int(os.getenv('AI_QUEUE_RETRY_AFTER', '5'))
+
+
+def _analysis_unavailable_response(error):
+    """Analysis can't be queued right now: the client should retry after a short while."""
+    response = jsonify({"error": str(error)})
+    response.headers['Retry-After'] = str(AI_QUEUE_RETRY_AFTER)
+    return response, 503
+
 
 @finance_bp.route('/<goal_id>', methods=['POST'])
 @jwt_required()
@@ -92,6 +105,8 @@ def budget_analysis():
     }
     
     Returns goal-specific analysis with Turkish description.
+    Returns 503 with Retry-After when the analysis queue is full or the
+    shared model is still being trained.
     """
     current_user_id = get_jwt_identity()
     
@@ -113,7 +128,7 @@ def budget_analysis():
         return jsonify({"error": "Goal not found or does not belong to user"}), 404
     
     # Import here to avoid circular dependencies
-    from services.ai_anomaly_service import AIService
+    from services.ai_anomaly_service import AIService, AnalysisUnavailable
     from models.model_lock_user_data import ModelLockUserData
     
     # Create user data object with goal information
@@ -123,7 +138,10 @@ def budget_analysis():
     ai_service = AIService()
     
     # Queue the request for background processing
-    ai_service.queue_request(user_data)
+    try:
+        ai_service.queue_request(user_data)
+    except AnalysisUnavailable as e:
+        return _analysis_unavailable_response(e)
     
     print(f"\n>>> Budget analysis request received for user: {current_user_id}, goal: {goal_id}")
     
@@ -135,13 +153,67 @@ def budget_analysis():
     }), 202
 
 
+@finance_bp.route('/budget_analysis/goals', methods=['POST'])
+@jwt_required()
+def budget_analysis_goals():
+    """
+    Budget analysis for several goals in one background job.
+    
+    Transactions are read and the model runs once for all goals; each goal's
+    result is then available from GET /finance/budget_analysis/<goal_id>/result.
+    
+    Request Body (optional):
+    {
+        "goal_ids": ["uuid-string", ...]  # Default: all of the user's goals
+    }
+    """
+    current_user_id = get_jwt_identity()
+    
+    data = request.get_json(silent=True) or {}
+    goal_ids = data.get('goal_ids')
+    if goal_ids is not None and (not isinstance(goal_ids, list) or not goal_ids):
+        return jsonify({"error": "goal_ids must be a non-empty list"}), 400
+    
+    # Verify goals belong to user
+    from models.goal_model import Goal
+    query = Goal.query.filter_by(user_id=current_user_id)
+    if goal_ids is not None:
+        query = query.filter(Goal.id.in_(goal_ids))
+    found_ids = sorted(goal.id for goal in query.all())
+    
+    if goal_ids is not None and len(found_ids) != len(set(goal_ids)):
+        missing = sorted(set(goal_ids) - set(found_ids))
+        return jsonify({"error": "Goal not found or does not belong to user", "goal_ids": missing}), 404
+    if not found_ids:
+        return jsonify({"error": "User has no goals to analyze"}), 404
+    
+    from services.ai_anomaly_service import AIService, AnalysisUnavailable
+    from models.model_lock_user_data import ModelLockUserData
+    
+    user_data = ModelLockUserData(current_user_id, goal_ids=found_ids)
+    try:
+        AIService().queue_request(user_data)
+    except AnalysisUnavailable as e:
+        return _analysis_unavailable_response(e)
+    
+    print(f"\n>>> Budget analysis request received for user: {current_user_id}, goals: {len(found_ids)}")
+    
+    return jsonify({
+        "status": "accepted",
+        "message": "Budget analysis queued for processing. Fetch each goal's result from /finance/budget_analysis/<goal_id>/result.",
+        "user_id": current_user_id,
+        "goal_ids": found_ids
+    }), 202
+
+
 @finance_bp.route('/budget_analysis/<goal_id>/result', methods=['GET'])
 @jwt_required()
 def get_budget_analysis_result(goal_id):
     """
     Get budget analysis result for a specific goal.
     
-    Returns cached result if available, otherwise 404.
+    Returns the stored result if available and still current (no transaction,
+    recurring transaction or goal change and no retraining since), otherwise 404.
     
     URL: GET /finance/budget_analysis/<goal_id>/result
     """
@@ -164,4 +236,22 @@ def get_budget_analysis_result(goal_id):
         return jsonify({
             "error": "No analysis result found for this goal",
             "message": "Budget analysis may still be processing or hasn't been requested yet. Please try again in a few seconds."
-        }), 404
\ No newline at end of file
+        }), 404
+
+
+@finance_bp.route('/budget_analysis/metrics', methods=['GET'])
+@jwt_required()
+@require_role('ADMIN')
+def get_budget_analysis_metrics():
+    """
+    Budget analysis queue counters (admin only).
+
+    requests: received, queued: jobs actually queued, coalesced: requests merged
+    into an identical queued/running job, processed: finished jobs,
+    pending: jobs queued or running right now, model_cache_hits/misses: loaded-model
+    cache lookups.
+
+    URL: GET /finance/budget_analysis/metrics
+    """
+    from services.ai_anomaly_service import AIService
+    return jsonify(AIService().get_metrics()), 200
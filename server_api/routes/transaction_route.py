@@ -1,19 +1,16 @@
 # routes/transaction_route.py (ANA BACKEND'İNİZ)
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from services.transaction_service import TransactionService
 from services.rbac_service import require_role
-import requests  # Diğer servise istek atmak için
+from services.anomaly_check_service import AnomalyCheckService
+from repositories.transaction_anomaly_repository import TransactionAnomalyRepository
 import json
-from datetime import datetime
-
-from services.category_service import CategoryService
 
 transaction_bp = Blueprint('transaction_bp', __name__, url_prefix='/users/<user_id>/transactions')
 transactionService = TransactionService()
-
-ANOMALY_SERVICE_URL = "http://127.0.0.1:5002/api/anomaly/check-transaction"
+anomalyCheckService = AnomalyCheckService()
 
 
 @transaction_bp.route('', methods=['GET'])
@@ -26,8 +23,16 @@ def get_transactions(user_id):
         if not (current_user and current_user.role == 'ADMIN'):
             return {"error": "Insufficient permissions"}, 403
 
-    transactions = transactionService.get_transactions_by_user(user_id)
-    return jsonify([t.serialize() for t in transactions])
+    # ?anomalies_only=true -> sadece anomali olarak işaretlenmiş işlemler (model çalıştırılmaz)
+    anomalies_only = request.args.get('anomalies_only', 'false').lower() in ('1', 'true', 'yes')
+    transactions = transactionService.get_transactions_with_anomaly(user_id, anomalies_only)
+
+    result = []
+    for t in transactions:
+        item = t.serialize()
+        item['anomaly'] = t.anomaly.serialize() if t.anomaly else None
+        result.append(item)
+    return jsonify(result)
 
 
 @transaction_bp.route('', methods=['POST'])
@@ -50,62 +55,11 @@ def create_transaction(user_id):
 
         transaction = transactionService.add_transaction_for_user(user_id, data)
 
-        anomaly_response_json = {"is_anomaly": None, "message": "Anomali kontrolü yapılamadı."}
-
-        try:
-            history_transactions = transactionService.get_transactions_by_user(user_id)
-
-            # -------- DÜZELTİLEN SATIRLAR BURADA --------
-            categoryService = CategoryService()
-            category_objects = categoryService.get_all_categories()
-
-            # frontend category_id olarak isim gönderiyor → map name:name
-            all_categories_map = {cat.name: cat.name for cat in category_objects}
-            # --------------------------------------------
-
-            history_list = []
-            for t in history_transactions:
-                history_list.append({
-                    "date": t.date.isoformat(),
-                    "amount": t.amount,
-                    "type": t.type.name,
-                    "category": all_categories_map.get(t.category_id, 'Other')
-                })
-
-            new_transaction_data = {
-                "date": data.get('date', datetime.now().isoformat()),
-                "amount": data.get('amount'),
-                "category": all_categories_map.get(data.get('category_id'), 'Other'),
-                "type": data.get('type')
-            }
-
-            anomaly_payload = {
-                "user_history": history_list,
-                "new_transaction": new_transaction_data
-            }
-
-            print("[DEBUG] Anomali servisine (Port 5002) gönderiliyor...")
-
-            response = requests.post(
-                ANOMALY_SERVICE_URL,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": auth_header
-                },
-                json=anomaly_payload,
-                timeout=10
-            )
-
-            if response.status_code == 200:
-                anomaly_response_json = response.json()
-                print(f"[DEBUG] Anomali sonucu: {anomaly_response_json.get('message')}")
-            else:
-                print(f"Anomali Servisi Hatası: {response.status_code} - {response.text}")
-                anomaly_response_json = {"is_anomaly": None, "message": "Anomali servisi yanıt vermiyor."}
-
-        except requests.exceptions.RequestException as e:
-            print(f"Anomali Servisi Bağlantı Hatası: {e}")
-            anomaly_response_json = {"is_anomaly": None, "message": "Anomali servisine bağlanılamadı."}
+        # Anomali kontrolü arka planda çalışır; sonuç işlemle birlikte saklanır ve
+        # GET /users/<user_id>/transactions/<transaction_id>/anomaly ile (veya push bildirimiyle) alınır
+        anomaly_response_json = anomalyCheckService.submit_check(
+            current_app._get_current_object(), user_id, transaction.id, data, auth_header, transaction.data_version
+        )
 
         final_response = transaction.serialize()
         final_response['anomaly_check'] = anomaly_response_json
@@ -120,6 +74,22 @@ def create_transaction(user_id):
         return {"error": "Internal server error"}, 500
 
 
+@transaction_bp.route('/<transaction_id>/anomaly', methods=['GET'])
+@jwt_required()
+def get_transaction_anomaly(user_id, transaction_id):
+    current_user_id = get_jwt_identity()
+    if current_user_id != user_id:
+        from models.user_model import User
+        current_user = User.query.get(current_user_id)
+        if not (current_user and current_user.role == 'ADMIN'):
+            return {"error": "Insufficient permissions"}, 403
+
+    anomaly = TransactionAnomalyRepository.get_for_user(user_id, transaction_id)
+    if not anomaly:
+        return {"error": "No anomaly check found for this transaction"}, 404
+    return jsonify(anomaly.serialize())
+
+
 @transaction_bp.route('/<transaction_id>', methods=['PUT'])
 @jwt_required()
 def update_transaction(user_id, transaction_id):
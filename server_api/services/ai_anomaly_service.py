@@ -4,12 +4,51 @@ import torch.optim as optim
 import os
 import threading
 from pathlib import Path
-from queue import Queue
+from queue import Queue, Empty, Full
+from concurrent.futures import Future
 import time
-from datetime import datetime, timedelta
-from collections import defaultdict
+from datetime import datetime
+from collections import OrderedDict
 import numpy as np
 from models.model_lock_user_data import ModelLockUserData
+from services.budget_feature_service import budget_features, FEATURE_SCOPES
+from services.data_version_service import DataVersionService
+from services.ai_result_store_service import AnalysisResultStore
+
+# Number of background worker threads consuming the request queue
+AI_WORKER_COUNT = int(os.getenv('AI_WORKER_COUNT', '2'))
+
+# Fixed pool of per-user locks; a user id always maps to the same one
+AI_USER_LOCK_STRIPES = int(os.getenv('AI_USER_LOCK_STRIPES', '64'))
+
+# Resource limits: the workers share the CPU with the Flask request threads.
+# Torch intra-op / inter-op threads, applied when the workers start. Process-wide,
+# so unset (0) keeps torch's defaults; e.g. 1 each leaves the cores to Flask.
+AI_TORCH_THREADS = int(os.getenv('AI_TORCH_THREADS', '0'))
+AI_TORCH_INTEROP_THREADS = int(os.getenv('AI_TORCH_INTEROP_THREADS', '0'))
+# Trainings running at the same time; other workers keep serving inference
+AI_MAX_CONCURRENT_TRAININGS = int(os.getenv('AI_MAX_CONCURRENT_TRAININGS', '1'))
+# Requests waiting for a worker (0 = unbounded); new requests are rejected when full
+AI_QUEUE_SIZE = int(os.getenv('AI_QUEUE_SIZE', '100'))
+
+# Loaded (eval-mode) models kept in memory, least recently used evicted first
+AI_MODEL_CACHE_SIZE = int(os.getenv('AI_MODEL_CACHE_SIZE', '64'))
+
+# Serve inference from a frozen TorchScript copy of each trained model
+AI_TORCHSCRIPT = os.getenv('AI_TORCHSCRIPT', 'true').lower() in ('1', 'true', 'yes')
+
+# per_user: one model file per user, trained on request.
+# shared: one model for all users, conditioned on per-user static features and
+# trained with `flask train_shared_model` (or in the background on first use, while
+# requests are rejected as unavailable); queued requests are answered in batches.
+AI_MODEL_MODE = os.getenv('AI_MODEL_MODE', 'per_user')
+AI_BATCH_SIZE = int(os.getenv('AI_BATCH_SIZE', '16'))
+AI_BATCH_MAX_WAIT_MS = int(os.getenv('AI_BATCH_MAX_WAIT_MS', '20'))
+# Model file / cache key of the shared model (torch_models/_shared_model.pth)
+SHARED_MODEL_KEY = '_shared'
+
+# Data a budget analysis result depends on; a write to any of them invalidates it
+RESULT_SCOPES = ('transactions', 'recurring', 'goals')
 
 
 # --- PYTORCH HYBRID LSTM-FFN MODEL ---
@@ -89,6 +128,136 @@ class BudgetHybridModel(nn.Module):
         return savings, prob, risk
 
 
+class AnalysisUnavailable(RuntimeError):
+    """The analysis can't be queued right now; the client should retry later."""
+
+
+class AnalysisQueueFull(AnalysisUnavailable):
+    """The request queue is full."""
+
+
+class SharedModelNotReady(AnalysisUnavailable):
+    """The shared model is still being trained."""
+
+
+def configure_torch_threads(intra_op=AI_TORCH_THREADS, inter_op=AI_TORCH_INTEROP_THREADS):
+    """Applies the torch thread limits to this process (0 leaves a setting at torch's default)."""
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            # Only possible before the first inter-op parallel work of the process
+            print(f"[AIService] Inter-op threads left at {torch.get_num_interop_threads()}: {e}")
+
+
+# --- TRAINING LOOP ---
+def fit_budget_model(x_seq_tensor, x_static_tensor, log_prefix=''):
+    """
+    Training loop shared by per-user, shared and batch training.
+    x_seq_tensor: (rows, 6, 3), x_static_tensor: (rows, 8). Every step trains
+    on 32 noisy copies of the rows (randomly picked when there are several).
+    Uses AdamW with aggressive LR and Early Stopping; returns the trained model.
+    """
+    # Targets (will be refined with synthetic data)
+    y_savings = torch.tensor([[100.0]], dtype=torch.float32)
+    y_prob = torch.tensor([[0.8]], dtype=torch.float32)
+    y_risk = torch.tensor([[0.2]], dtype=torch.float32)
+
+    # Initialize Model with AdamW (aggressive LR)
+    model = BudgetHybridModel()
+    optimizer = optim.AdamW(model.parameters(), lr=0.005, weight_decay=1e-5)
+    
+    # Early Stopping Setup
+    best_loss = float('inf')
+    patience, trigger_times = 5, 0
+    
+    model.train()
+    for epoch in range(50):  # Max 50 epochs
+        optimizer.zero_grad()
+        
+        # Create synthetic batch with noise for generalization
+        batch_size = 32
+        if len(x_seq_tensor) == 1:
+            base_seq = x_seq_tensor.repeat(batch_size, 1, 1)
+            base_static = x_static_tensor.repeat(batch_size, 1)
+        else:
+            rows = torch.randint(len(x_seq_tensor), (batch_size,))
+            base_seq, base_static = x_seq_tensor[rows], x_static_tensor[rows]
+        batch_seq = base_seq + torch.randn(batch_size, 6, 3) * 0.1
+        batch_static = base_static + torch.randn(batch_size, 8) * 0.1
+        
+        savings, prob, risk = model(batch_seq, batch_static)
+        
+        loss = nn.MSELoss()(savings, y_savings.repeat(batch_size, 1)) + \
+               nn.BCELoss()(prob, y_prob.repeat(batch_size, 1)) + \
+               nn.BCELoss()(risk, y_risk.repeat(batch_size, 1))
+               
+        loss.backward()
+        optimizer.step()
+        
+        # Early Stopping Check
+        current_loss = loss.item()
+        if current_loss < best_loss - 1e-4:
+            best_loss = current_loss
+            trigger_times = 0
+        else:
+            trigger_times += 1
+            if trigger_times >= patience:
+                print(f"[{log_prefix}] Early stopping at epoch {epoch}")
+                break
+    
+    return model
+
+
+def temp_path_for(path: Path) -> Path:
+    """Sibling path to write a file to before renaming it over 'path'."""
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+
+# --- LOADED MODEL CACHE ---
+class LoadedModelCache:
+    """
+    Size-bounded LRU of loaded inference models (eager BudgetHybridModel in
+    eval() mode or its TorchScript copy), keyed by user and model version
+    (the .pth file's modification time). A retrained model has a new version,
+    so a stale instance is never served, also when another process wrote the
+    file. Models are only read after loading (eval + no_grad), so one
+    instance can serve several threads.
+    """
+
+    def __init__(self, max_models=AI_MODEL_CACHE_SIZE):
+        self.max_models = max_models
+        self._models = OrderedDict()  # user_id -> (version, model)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, version, loader):
+        """Cached model for (user_id, version), otherwise loader() is called and cached."""
+        with self._lock:
+            cached = self._models.get(user_id)
+            if cached is not None and cached[0] == version:
+                self._models.move_to_end(user_id)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        model = loader()
+
+        with self._lock:
+            self._models[user_id] = (version, model)
+            self._models.move_to_end(user_id)
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+        return model
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._models.pop(user_id, None)
+
+
 # --- AI SERVICE ---
 class AIService:
     """
@@ -101,6 +270,7 @@ class AIService:
     - AdamW optimizer with aggressive LR for fast learning
     - Early stopping to prevent overfitting
     - Dropout for regularization
+    - Optional shared model (AI_MODEL_MODE=shared) with batched inference across users
     """
     
     _instance = None
@@ -122,12 +292,28 @@ class AIService:
         self.models_dir.mkdir(exist_ok=True)
         
         self.app_instance = None
-        self.training_lock = threading.Lock()
-        self.request_queue = Queue()
-        self.results_cache = {}
-        self.results_lock = threading.Lock()
-        self.worker_thread = None
+        # Per-user locks: different users train/infer in parallel,
+        # requests for the same user run one after another
+        self.user_locks = [threading.RLock() for _ in range(max(1, AI_USER_LOCK_STRIPES))]
+        self.request_queue = Queue(maxsize=max(0, AI_QUEUE_SIZE))
+        self.training_slots = threading.BoundedSemaphore(max(1, AI_MAX_CONCURRENT_TRAININGS))
+        # Queued or running jobs by (user_id, goal_id, goal_date); an identical
+        # request joins the existing job instead of being queued again
+        self.pending_jobs = {}
+        self.pending_lock = threading.Lock()
+        self.metrics = {"requests": 0, "queued": 0, "coalesced": 0, "rejected": 0, "processed": 0, "batches": 0}
+        self.model_mode = AI_MODEL_MODE
+        self.batch_size = max(1, AI_BATCH_SIZE)
+        self.batch_max_wait = AI_BATCH_MAX_WAIT_MS / 1000
+        self.model_cache = LoadedModelCache()
+        # Bounded result store (AI_RESULT_STORE: memory or database)
+        self.results = AnalysisResultStore(self.result_versions)
+        self.worker_count = AI_WORKER_COUNT
+        self.worker_threads = []
         self.worker_running = False
+        # Background first-use training of the shared model (see ensure_shared_model)
+        self.shared_training_thread = None
+        self.shared_training_guard = threading.Lock()
         
         print("[AIService] Initialized successfully")
 
@@ -137,8 +323,25 @@ class AIService:
 
     def save_metadata(self, user_id: str, data: dict):
         import json
-        with open(self.get_metadata_path(user_id), 'w') as f:
+        path = self.get_metadata_path(user_id)
+        tmp_path = temp_path_for(path)
+        with open(tmp_path, 'w') as f:
             json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def save_model(self, owner: str, model: nn.Module, metadata: dict):
+        """
+        Writes a trained model (state dict, TorchScript copy) and its metadata.
+        Each file is written aside and renamed into place, so the server and
+        the batch trainer never read a partially written file.
+        """
+        model_path = self.get_model_path(owner)
+        tmp_path = temp_path_for(model_path)
+        torch.save(model.state_dict(), tmp_path)
+        os.replace(tmp_path, model_path)
+        self.export_runtime(owner, model)
+        self.save_metadata(owner, metadata)
+        self.model_cache.invalidate(owner)
             
     def get_metadata(self, user_id: str) -> dict:
         import json
@@ -151,31 +354,86 @@ class AIService:
     def get_model_path(self, user_id: str) -> Path:
         return self.models_dir / f"{user_id}_model.pth"
 
+    def get_script_path(self, user_id: str) -> Path:
+        return self.models_dir / f"{user_id}_model.pt"
+
+    def get_model_owner(self, user_id: str) -> str:
+        """Whose model file serves the user: their own, or the shared model."""
+        return SHARED_MODEL_KEY if self.model_mode == 'shared' else user_id
+
     def is_trained(self, user_id: str) -> bool:
-        return self.get_model_path(user_id).exists()
+        return self.get_model_path(self.get_model_owner(user_id)).exists()
+
+    def get_model_version(self, user_id: str):
+        """Changes whenever a new model serving the user is saved; None if untrained."""
+        try:
+            return self.get_model_path(self.get_model_owner(user_id)).stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def result_versions(self, user_id: str) -> dict:
+        """Versions a stored result is valid for: the user's data and the trained model."""
+        versions = DataVersionService.get_versions(user_id, RESULT_SCOPES)
+        versions["model"] = self.get_model_version(user_id)
+        return versions
+
+    def get_user_lock(self, user_id: str) -> threading.RLock:
+        # Striped: memory stays bounded however many users are seen; two users
+        # sharing a stripe only wait for each other now and then
+        return self.user_locks[hash(user_id) % len(self.user_locks)]
+
+    # --- INFERENCE RUNTIME ---
+    def export_runtime(self, owner: str, model: nn.Module) -> bool:
+        """
+        Saves a frozen TorchScript copy of a trained model next to its state
+        dict; inference loads it instead of rebuilding the eager model.
+        """
+        if not AI_TORCHSCRIPT:
+            return False
+        try:
+            scripted = torch.jit.freeze(torch.jit.script(model.eval()))
+            # Written aside and renamed: a concurrent load never sees a partial file
+            script_path = self.get_script_path(owner)
+            tmp_path = temp_path_for(script_path)
+            torch.jit.save(scripted, str(tmp_path))
+            os.replace(tmp_path, script_path)
+            return True
+        except Exception as e:
+            print(f"[{owner}] TorchScript export failed, using the eager model: {e}")
+            return False
+
+    def load_inference_model(self, owner: str):
+        """
+        The model to run for an owner (user id or the shared model key):
+        its TorchScript copy when it is at least as new as the state dict,
+        otherwise the eager model (exported on the way for the next load).
+        """
+        model_path = self.get_model_path(owner)
+        script_path = self.get_script_path(owner)
+        if AI_TORCHSCRIPT and script_path.exists() and script_path.stat().st_mtime_ns >= model_path.stat().st_mtime_ns:
+            return torch.jit.load(str(script_path))
+        
+        model = BudgetHybridModel()
+        model.load_state_dict(torch.load(model_path))
+        model.eval()
+        # Models trained before TorchScript export was enabled
+        self.export_runtime(owner, model)
+        return model
+
+    def get_inference_model(self, owner: str):
+        """Loaded model for an owner, cached per model version."""
+        return self.model_cache.get(owner, self.get_model_version(owner), lambda: self.load_inference_model(owner))
 
     # --- TRADITIONAL ALGORITHM ---
-    def calculate_traditional_metrics(self, transactions, recurring_txs):
+    def calculate_traditional_metrics(self, features):
         """
         Traditional Rule-Based Algorithm (50/30/20 Rule Adaptation).
         Analyzes spending habits without ML.
+        features: the user's BudgetFeatures (totals include recurring transactions).
         
         Returns: (recommended_savings, success_prob, risk_level)
         """
-        total_income = 0
-        total_expenses = 0
-        
-        for t in transactions:
-            if t.type.value == 'income':
-                total_income += float(t.amount)
-            else:
-                total_expenses += float(t.amount)
-            
-        for rt in recurring_txs:
-            if rt.type == 'income':
-                total_income += float(rt.amount)
-            else:
-                total_expenses += float(rt.amount)
+        total_income, total_expenses = features.total_income, features.total_expenses
             
         if total_income == 0:
             return 0, 20, 80
@@ -206,100 +464,28 @@ class AIService:
         Uses AdamW optimizer with aggressive LR and Early Stopping.
         """
         user_id = user_data.user_id
+        user_lock = self.get_user_lock(user_id)
         
-        if not self.training_lock.acquire(blocking=False):
-            print(f"[{user_id}] Training already in progress. Skipping.")
-            return
+        # Waits for an in-progress training of the same user instead of skipping
+        user_lock.acquire()
 
         try:
-            from models.transaction_model import UserTransaction
-            from models.recurring_transaction_model import RecurringTransaction
-            
-            transactions = UserTransaction.query.filter_by(user_id=user_id).all()
-            recurring_txs = RecurringTransaction.query.filter_by(user_id=user_id).all()
-            total_data_points = len(transactions) + len(recurring_txs)
-            
-            # --- Prepare Sequential Data (6 months) ---
-            monthly_stats = defaultdict(lambda: {'income': 0, 'expenses': 0})
-            
-            def get_month_key(date_obj):
-                return date_obj.strftime('%Y-%m')
-            
-            for t in transactions:
-                key = 'income' if t.type.value == 'income' else 'expenses'
-                monthly_stats[get_month_key(t.date)][key] += float(t.amount)
-                
-            for rt in recurring_txs:
-                current_month = datetime.now()
-                for i in range(6):
-                    m_key = get_month_key(current_month - timedelta(days=30*i))
-                    key = 'income' if rt.type == 'income' else 'expenses'
-                    monthly_stats[m_key][key] += float(rt.amount)
-
-            sorted_months = sorted(monthly_stats.keys())
-            sequence_data = []
-            for m in sorted_months[-6:]:
-                d = monthly_stats[m]
-                inc, exp = d['income'], d['expenses']
-                ratio = (inc - exp) / max(inc, 1)
-                sequence_data.append([inc, exp, ratio])
+            # Versions first: data written meanwhile makes the model stale, not current
+            data_versions = DataVersionService.get_versions(user_id, FEATURE_SCOPES)
+            features = budget_features.get(user_id)
                 
-            while len(sequence_data) < 6:
-                sequence_data.insert(0, [0.0, 0.0, 0.0])
-                
-            x_seq_tensor = torch.tensor([sequence_data], dtype=torch.float32)
-            x_static_tensor = torch.randn(1, 8)  # Placeholder static features
-            
-            # Targets (will be refined with synthetic data)
-            y_savings = torch.tensor([[100.0]], dtype=torch.float32)
-            y_prob = torch.tensor([[0.8]], dtype=torch.float32)
-            y_risk = torch.tensor([[0.2]], dtype=torch.float32)
-
-            # Initialize Model with AdamW (aggressive LR)
-            model = BudgetHybridModel()
-            optimizer = optim.AdamW(model.parameters(), lr=0.005, weight_decay=1e-5)
+            x_seq_tensor = torch.tensor([features.sequence], dtype=torch.float32)
+            x_static_tensor = torch.tensor([features.static], dtype=torch.float32)
             
-            # Early Stopping Setup
-            best_loss = float('inf')
-            patience, trigger_times = 5, 0
+            # Bounded number of trainings at once (AI_MAX_CONCURRENT_TRAININGS)
+            with self.training_slots:
+                model = fit_budget_model(x_seq_tensor, x_static_tensor, user_id)
             
-            model.train()
-            for epoch in range(50):  # Max 50 epochs
-                optimizer.zero_grad()
-                
-                # Create synthetic batch with noise for generalization
-                batch_size = 32
-                batch_seq = x_seq_tensor.repeat(batch_size, 1, 1) + torch.randn(batch_size, 6, 3) * 0.1
-                batch_static = x_static_tensor.repeat(batch_size, 1) + torch.randn(batch_size, 8) * 0.1
-                
-                savings, prob, risk = model(batch_seq, batch_static)
-                
-                loss = nn.MSELoss()(savings, y_savings.repeat(batch_size, 1)) + \
-                       nn.BCELoss()(prob, y_prob.repeat(batch_size, 1)) + \
-                       nn.BCELoss()(risk, y_risk.repeat(batch_size, 1))
-                       
-                loss.backward()
-                optimizer.step()
-                
-                # Early Stopping Check
-                current_loss = loss.item()
-                if current_loss < best_loss - 1e-4:
-                    best_loss = current_loss
-                    trigger_times = 0
-                else:
-                    trigger_times += 1
-                    if trigger_times >= patience:
-                        print(f"[{user_id}] Early stopping at epoch {epoch}")
-                        break
-            
-            # Save Model
-            save_path = self.get_model_path(user_id)
-            torch.save(model.state_dict(), save_path)
-            
-            self.save_metadata(user_id, {
+            self.save_model(user_id, model, {
                 "last_train_date": datetime.now().isoformat(),
-                "training_count": total_data_points,
-                "model_type": "hybrid_lstm"
+                "training_count": features.data_points,
+                "model_type": "hybrid_lstm",
+                "data_versions": data_versions
             })
             print(f"[{user_id}] Hybrid Training completed.")
             
@@ -308,234 +494,379 @@ class AIService:
             import traceback
             traceback.print_exc()
         finally:
-            self.training_lock.release()
+            user_lock.release()
 
-    # --- INFERENCE METHOD ---
+    def train_shared(self, user_ids: list = None) -> int:
+        """
+        Train the shared model (AI_MODEL_MODE=shared) on every user's data, or
+        the given users'. Same objective and inputs as train(), but samples
+        are drawn from all users, so one network serves all users. Needs an
+        app context.
+        Returns the number of users trained on.
+        """
+        from database.db import db
+        from models.transaction_model import UserTransaction
+        
+        if user_ids is None:
+            user_ids = [row[0] for row in db.session.query(UserTransaction.user_id).distinct()]
+        if not user_ids:
+            print("[Shared] No users with transactions, nothing to train")
+            return 0
+        
+        data_versions = {user_id: DataVersionService.get_versions(user_id, FEATURE_SCOPES) for user_id in user_ids}
+        features = [budget_features.get(user_id) for user_id in user_ids]
+        x_seq = torch.tensor([item.sequence for item in features], dtype=torch.float32)
+        x_static = torch.tensor([item.static for item in features], dtype=torch.float32)
+        
+        model = fit_budget_model(x_seq, x_static, 'Shared')
+        
+        self.save_model(SHARED_MODEL_KEY, model, {
+            "last_train_date": datetime.now().isoformat(),
+            "training_users": len(user_ids),
+            "model_type": "hybrid_lstm_shared",
+            "data_versions": data_versions
+        })
+        print(f"[Shared] Training completed on {len(user_ids)} users.")
+        return len(user_ids)
+
+    # --- INFERENCE METHODS ---
     def prompt(self, user_id: str, goal_id: str, goal_date: str = None):
         """
         Perform budget analysis using Hybrid LSTM + Traditional Algorithm ensemble.
         """
-        if not self.is_trained(user_id):
-            print(f"[{user_id}] ERROR: Model not found!")
-            return None
+        results = self.prompt_goals(user_id, [goal_id], {goal_id: goal_date} if goal_date else None)
+        return results.get(goal_id) if results else None
 
-        try:
-            from models.goal_model import Goal
-            from models.goal_date import GoalDate
-            from models.transaction_model import UserTransaction
-            from models.recurring_transaction_model import RecurringTransaction
-            
-            # Fetch goal information
-            goal = Goal.query.filter_by(id=goal_id, user_id=user_id).first()
-            if not goal:
-                print(f"[{user_id}] ERROR: Goal {goal_id} not found!")
-                return None
-            
-            # Get goal date
-            if goal_date:
-                goal_date_obj = GoalDate.query.filter_by(goal_id=goal_id, date=goal_date).first()
-            else:
-                goal_date_obj = GoalDate.query.filter_by(goal_id=goal_id).order_by(GoalDate.date.desc()).first()
-            
-            if not goal_date_obj:
-                target_date = datetime.now()
-                months_remaining = 12
-            else:
-                target_date = datetime.fromisoformat(str(goal_date_obj.date))
-                months_delta = (target_date.year - datetime.now().year) * 12 + (target_date.month - datetime.now().month)
-                months_remaining = max(1, months_delta)
-            
-            # Goal info
-            target_amount = float(goal.target_amount)
-            current_amount = float(goal.current_amount)
-            remaining_amount = max(0, target_amount - current_amount)
-            
-            # Fetch transaction data
-            transactions = UserTransaction.query.filter_by(user_id=user_id).all()
-            recurring_txs = RecurringTransaction.query.filter_by(user_id=user_id).all()
-            
-            # Calculate financial features
-            total_income = 0
-            total_expenses = 0
-            monthly_data = defaultdict(lambda: {'income': 0, 'expenses': 0})
-            
-            for t in transactions:
-                month_key = t.date.strftime('%Y-%m')
-                if t.type.value == 'income':
-                    total_income += float(t.amount)
-                    monthly_data[month_key]['income'] += float(t.amount)
-                else:
-                    total_expenses += float(t.amount)
-                    monthly_data[month_key]['expenses'] += float(t.amount)
-            
-            for rt in recurring_txs:
-                if rt.type == 'income':
-                    total_income += float(rt.amount)
-                else:
-                    total_expenses += float(rt.amount)
-            
-            months_with_data = max(len(monthly_data), 1)
-            avg_monthly_income = total_income / months_with_data
-            avg_monthly_expenses = total_expenses / months_with_data
-            
-            # --- Prepare Sequential Data for LSTM ---
-            monthly_stats = defaultdict(lambda: {'income': 0, 'expenses': 0})
-            
-            def get_month_key(date_obj):
-                return date_obj.strftime('%Y-%m')
+    def prompt_goals(self, user_id: str, goal_ids: list = None, goal_dates: dict = None):
+        """
+        Budget analysis for several goals of one user in one pass (all of the
+        user's goals when goal_ids is None). The model inputs don't depend on
+        the goal, so the features and the forward pass are computed once and
+        only the goal-specific post-processing runs per goal, vectorized.
+
+        goal_dates: optional {goal_id: 'YYYY-MM-DD'}; otherwise a goal's latest date is used.
+        Returns {goal_id: result} (goals that don't exist are skipped), None on failure.
+        """
+        return self.prompt_batch([(user_id, goal_ids, goal_dates)])[0]
+
+    def prompt_batch(self, requests: list) -> list:
+        """
+        prompt_goals for several (user_id, goal_ids, goal_dates) requests.
+        With the shared model (AI_MODEL_MODE=shared) all requests go through
+        one batched forward pass; per-user models run one by one.
+        Returns one prompt_goals result per request (None entries are skipped).
+        """
+        from models.goal_model import Goal
+        
+        results = [None] * len(requests)
+        prepared = []
+        for index, request in enumerate(requests):
+            if request is None:
+                continue
+            user_id, goal_ids, goal_dates = request
+            if not self.is_trained(user_id):
+                print(f"[{user_id}] ERROR: Model not found!")
+                continue
             
-            for t in transactions:
-                key = 'income' if t.type.value == 'income' else 'expenses'
-                monthly_stats[get_month_key(t.date)][key] += float(t.amount)
+            try:
+                # Read before the data: a write during the analysis leaves the result stale, not current
+                versions = self.result_versions(user_id)
                 
-            for rt in recurring_txs:
-                current_month = datetime.now()
-                for i in range(6):
-                    m_key = get_month_key(current_month - timedelta(days=30*i))
-                    key = 'income' if rt.type == 'income' else 'expenses'
-                    monthly_stats[m_key][key] += float(rt.amount)
-
-            sorted_months = sorted(monthly_stats.keys())
-            sequence_data = []
-            for m in sorted_months[-6:]:
-                d = monthly_stats[m]
-                inc, exp = d['income'], d['expenses']
-                ratio = (inc - exp) / max(inc, 1)
-                sequence_data.append([inc, exp, ratio])
+                # Fetch goal information
+                query = Goal.query.filter_by(user_id=user_id)
+                if goal_ids is not None:
+                    query = query.filter(Goal.id.in_(goal_ids))
+                goals = query.all()
                 
-            while len(sequence_data) < 6:
-                sequence_data.insert(0, [0.0, 0.0, 0.0])
+                for goal_id in set(goal_ids or ()) - {goal.id for goal in goals}:
+                    print(f"[{user_id}] ERROR: Goal {goal_id} not found!")
+                if not goals:
+                    results[index] = {}
+                    continue
                 
-            x_seq_tensor = torch.tensor([sequence_data], dtype=torch.float32)
-            x_static_tensor = torch.randn(1, 8)
-            
-            # Load model
-            model = BudgetHybridModel()
-            model.load_state_dict(torch.load(self.get_model_path(user_id)))
-            model.eval()
+                horizons = self._goal_horizons(goals, goal_dates or {})
+                prepared.append((index, user_id, versions, goals, horizons, budget_features.get(user_id)))
+            except Exception as e:
+                print(f"[{user_id}] Inference failed: {str(e)}")
+                import traceback
+                traceback.print_exc()
+        
+        if not prepared:
+            return results
+        
+        try:
+            outputs = self._run_models([item[1] for item in prepared], [item[5] for item in prepared])
+        except Exception as e:
+            print(f"[AIService] Inference failed for {len(prepared)} request(s): {str(e)}")
+            import traceback
+            traceback.print_exc()
+            return results
+        
+        for (index, user_id, versions, goals, horizons, features), output in zip(prepared, outputs):
+            try:
+                signals = self._ensemble(user_id, features, output)
+                results[index] = self._goal_results(user_id, versions, goals, horizons, signals)
+            except Exception as e:
+                print(f"[{user_id}] Inference failed: {str(e)}")
+                import traceback
+                traceback.print_exc()
+        return results
 
-            # LSTM Model Inference
-            with torch.no_grad():
-                savings, prob, risk = model(x_seq_tensor, x_static_tensor)
-            
-            model_savings = savings.item()
-            model_prob = prob.item() * 100
-            model_risk = risk.item() * 100
-            
-            # --- HYBRID ENSEMBLE: LSTM + Traditional Algorithm ---
-            trad_savings, trad_prob, trad_risk = self.calculate_traditional_metrics(transactions, recurring_txs)
-            
-            print(f"[{user_id}] LSTM: Sav={model_savings:.0f}, Prob={model_prob:.0f}%, Risk={model_risk:.0f}%")
-            print(f"[{user_id}] Trad: Sav={trad_savings:.0f}, Prob={trad_prob:.0f}%, Risk={trad_risk:.0f}%")
-            
-            # Average (60% Model, 40% Traditional)
-            savings_raw = (model_savings * 0.6) + (trad_savings * 0.4)
-            prob_raw = ((model_prob * 0.6) + (trad_prob * 0.4)) / 100.0
-            risk_raw = ((model_risk * 0.6) + (trad_risk * 0.4)) / 100.0
-            
-            # --- REALISTIC OUTPUT PROCESSING ---
-            actual_monthly_savings = max(0, avg_monthly_income - avg_monthly_expenses)
-            required_monthly = remaining_amount / max(months_remaining, 1)
-            
-            # Monthly Savings Recommendation
-            if required_monthly > avg_monthly_income * 0.7:
-                aylik_tasarruf = min(avg_monthly_income * 0.7, actual_monthly_savings * 1.2)
-            elif required_monthly > actual_monthly_savings:
-                aylik_tasarruf = (required_monthly * 0.6) + (max(0, savings_raw) * 0.4)
-                aylik_tasarruf = min(aylik_tasarruf, actual_monthly_savings * 1.2)
-            else:
-                aylik_tasarruf = required_monthly
-            
-            min_limit = min(100.0, required_monthly)
-            aylik_tasarruf = max(min_limit, min(aylik_tasarruf, avg_monthly_income * 0.75))
-            
-            # Success Probability
-            savings_gap = required_monthly / max(actual_monthly_savings, 1.0)
-            base_prob = prob_raw * 100
-            
-            if savings_gap <= 0.5:
-                boost = (0.5 - savings_gap) * 60
-                basari_olasiligi = min(98, base_prob + boost)
-                if savings_gap < 0.2:
-                    basari_olasiligi = max(basari_olasiligi, 90)
-            elif savings_gap <= 1.0:
-                penalty_factor = 1.0 - ((savings_gap - 0.5) * 0.2)
-                basari_olasiligi = base_prob * penalty_factor
-            else:
-                penalty_factor = 1.0 / (1.0 + (savings_gap - 1.0) * 2.0)
-                basari_olasiligi = base_prob * penalty_factor
-            
-            income_share = required_monthly / max(avg_monthly_income, 1.0)
-            if income_share > 0.5:
-                basari_olasiligi = min(basari_olasiligi, 60)
-            if income_share > 0.7:
-                basari_olasiligi = min(basari_olasiligi, 30)
-                
-            basari_olasiligi = max(5, round(basari_olasiligi, 0))
-            
-            # Risk Level
-            base_risk = risk_raw * 100
-            if savings_gap > 2.0:
-                risk_seviyesi = max(65, min(90, base_risk + 40))
-            elif savings_gap > 1.5:
-                risk_seviyesi = max(45, min(75, base_risk + 25))
-            elif savings_gap > 1.0:
-                risk_seviyesi = max(25, min(55, base_risk + 15))
-            else:
-                risk_seviyesi = max(5, min(35, base_risk))
-                
-            risk_seviyesi = max(5, round(risk_seviyesi, 0))
-            
-            if basari_olasiligi + risk_seviyesi > 110:
-                risk_seviyesi = max(10, 105 - basari_olasiligi)
-            
+    def _goal_results(self, user_id: str, versions: dict, goals: list, horizons, signals: dict) -> dict:
+        """Post-processes the ensemble signals for every goal and stores the results."""
+        target_dates, months_remaining = horizons
+        
+        # Goal info
+        target_amount = np.array([float(goal.target_amount) for goal in goals])
+        current_amount = np.array([float(goal.current_amount) for goal in goals])
+        remaining_amount = np.maximum(0, target_amount - current_amount)
+        
+        aylik_tasarruf, basari_olasiligi, risk_seviyesi = self._goal_recommendations(
+            signals, remaining_amount, np.array(months_remaining)
+        )
+        
+        results = {}
+        for i, goal in enumerate(goals):
             # Generate Turkish description
-            risk_label = "düşük" if risk_seviyesi < 33 else "orta" if risk_seviyesi < 67 else "yüksek"
+            risk_label = "düşük" if risk_seviyesi[i] < 33 else "orta" if risk_seviyesi[i] < 67 else "yüksek"
             
             aciklama = (
-                f"{months_remaining} aylık {goal.name} hedefiniz için "
-                f"aylık {aylik_tasarruf:,.0f} TL tasarruf öneriyoruz. "
-                f"Başarı şansınız %{basari_olasiligi:.0f}, "
-                f"risk seviyeniz {risk_label} (%{risk_seviyesi:.0f})."
+                f"{months_remaining[i]} aylık {goal.name} hedefiniz için "
+                f"aylık {aylik_tasarruf[i]:,.0f} TL tasarruf öneriyoruz. "
+                f"Başarı şansınız %{basari_olasiligi[i]:.0f}, "
+                f"risk seviyeniz {risk_label} (%{risk_seviyesi[i]:.0f})."
             )
             
             result = {
-                "aylik_tasarruf": round(aylik_tasarruf, 2),
-                "basari_olasiligi": round(basari_olasiligi, 2),
-                "risk_seviyesi": round(risk_seviyesi, 2),
+                "aylik_tasarruf": round(float(aylik_tasarruf[i]), 2),
+                "basari_olasiligi": round(float(basari_olasiligi[i]), 2),
+                "risk_seviyesi": round(float(risk_seviyesi[i]), 2),
                 "aciklama": aciklama,
                 "goal_info": {
                     "goal_name": goal.name,
-                    "target_amount": target_amount,
-                    "current_amount": current_amount,
-                    "remaining_amount": remaining_amount,
-                    "target_date": target_date.strftime('%Y-%m-%d') if goal_date_obj else None,
-                    "months_remaining": months_remaining
+                    "target_amount": float(target_amount[i]),
+                    "current_amount": float(current_amount[i]),
+                    "remaining_amount": float(remaining_amount[i]),
+                    "target_date": target_dates[i].strftime('%Y-%m-%d') if target_dates[i] else None,
+                    "months_remaining": months_remaining[i]
                 }
             }
             
             # Cache result
-            with self.results_lock:
-                self.results_cache[goal_id] = result
-                print(f"[{user_id}] Result cached for goal_id: {goal_id}")
-            
+            self.results.put(goal.id, user_id, versions, result)
             print(f"[{user_id}] Budget Analysis for goal '{goal.name}': {result}")
-            return result
+            results[goal.id] = result
+        
+        return results
+
+    def _goal_horizons(self, goals, goal_dates: dict):
+        """
+        (target_dates, months_remaining) per goal: the requested goal date, or
+        the goal's latest one. Goals without a (matching) date get 12 months
+        and no target date.
+        """
+        from models.goal_date import GoalDate
+        
+        latest = {}
+        rows = (
+            GoalDate.query
+            .filter(GoalDate.goal_id.in_([goal.id for goal in goals if not goal_dates.get(goal.id)]))
+            .order_by(GoalDate.date.desc())
+            .all()
+        )
+        for goal_date_obj in rows:
+            latest.setdefault(goal_date_obj.goal_id, goal_date_obj)
+        
+        now = datetime.now()
+        target_dates, months_remaining = [], []
+        for goal in goals:
+            if goal_dates.get(goal.id):
+                goal_date_obj = GoalDate.query.filter_by(goal_id=goal.id, date=goal_dates[goal.id]).first()
+            else:
+                goal_date_obj = latest.get(goal.id)
             
-        except Exception as e:
-            print(f"[{user_id}] Inference failed: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return None
+            if not goal_date_obj:
+                target_dates.append(None)
+                months_remaining.append(12)
+            else:
+                target_date = datetime.fromisoformat(str(goal_date_obj.date))
+                months_delta = (target_date.year - now.year) * 12 + (target_date.month - now.month)
+                target_dates.append(target_date)
+                months_remaining.append(max(1, months_delta))
+        return target_dates, months_remaining
+
+    def _run_models(self, user_ids: list, features: list) -> list:
+        """(savings, prob, risk) model outputs for each user's BudgetFeatures."""
+        if self.model_mode == 'shared':
+            model = self.get_inference_model(SHARED_MODEL_KEY)
+            x_seq_tensor = torch.tensor([item.sequence for item in features], dtype=torch.float32)
+            x_static_tensor = torch.tensor([item.static for item in features], dtype=torch.float32)
+            
+            # One forward pass for every user in the batch
+            with torch.no_grad():
+                savings, prob, risk = model(x_seq_tensor, x_static_tensor)
+            return list(zip(savings[:, 0].tolist(), prob[:, 0].tolist(), risk[:, 0].tolist()))
+        
+        outputs = []
+        for user_id, user_features in zip(user_ids, features):
+            x_seq_tensor = torch.tensor([user_features.sequence], dtype=torch.float32)
+            x_static_tensor = torch.tensor([user_features.static], dtype=torch.float32)
+            
+            # Load model (cached per user and model version)
+            model = self.get_inference_model(user_id)
+
+            # LSTM Model Inference
+            with torch.no_grad():
+                savings, prob, risk = model(x_seq_tensor, x_static_tensor)
+            outputs.append((savings.item(), prob.item(), risk.item()))
+        return outputs
+
+    def _ensemble(self, user_id: str, features, output: tuple) -> dict:
+        """
+        Goal-independent signals: the model outputs blended with the
+        traditional metrics, plus the monthly averages.
+        """
+        model_savings = output[0]
+        model_prob = output[1] * 100
+        model_risk = output[2] * 100
+        
+        # --- HYBRID ENSEMBLE: LSTM + Traditional Algorithm ---
+        trad_savings, trad_prob, trad_risk = self.calculate_traditional_metrics(features)
+        
+        print(f"[{user_id}] LSTM: Sav={model_savings:.0f}, Prob={model_prob:.0f}%, Risk={model_risk:.0f}%")
+        print(f"[{user_id}] Trad: Sav={trad_savings:.0f}, Prob={trad_prob:.0f}%, Risk={trad_risk:.0f}%")
+        
+        # Average (60% Model, 40% Traditional)
+        return {
+            "avg_monthly_income": features.avg_monthly_income,
+            "avg_monthly_expenses": features.avg_monthly_expenses,
+            "savings_raw": (model_savings * 0.6) + (trad_savings * 0.4),
+            "prob_raw": ((model_prob * 0.6) + (trad_prob * 0.4)) / 100.0,
+            "risk_raw": ((model_risk * 0.6) + (trad_risk * 0.4)) / 100.0
+        }
+
+    @staticmethod
+    def _goal_recommendations(signals: dict, remaining_amount: np.ndarray, months_remaining: np.ndarray):
+        """
+        Realistic output processing for N goals at once.
+        Returns (aylik_tasarruf, basari_olasiligi, risk_seviyesi) arrays.
+        """
+        avg_monthly_income = signals["avg_monthly_income"]
+        
+        # --- REALISTIC OUTPUT PROCESSING ---
+        actual_monthly_savings = max(0, avg_monthly_income - signals["avg_monthly_expenses"])
+        required_monthly = remaining_amount / np.maximum(months_remaining, 1)
+        
+        # Monthly Savings Recommendation
+        aylik_tasarruf = np.select(
+            [required_monthly > avg_monthly_income * 0.7, required_monthly > actual_monthly_savings],
+            [
+                min(avg_monthly_income * 0.7, actual_monthly_savings * 1.2),
+                np.minimum((required_monthly * 0.6) + (max(0, signals["savings_raw"]) * 0.4), actual_monthly_savings * 1.2)
+            ],
+            default=required_monthly
+        )
+        
+        min_limit = np.minimum(100.0, required_monthly)
+        aylik_tasarruf = np.maximum(min_limit, np.minimum(aylik_tasarruf, avg_monthly_income * 0.75))
+        
+        # Success Probability
+        savings_gap = required_monthly / max(actual_monthly_savings, 1.0)
+        base_prob = signals["prob_raw"] * 100
+        
+        # np.select evaluates every branch; the unused ones may divide by zero
+        with np.errstate(divide='ignore', invalid='ignore'):
+            boosted = np.minimum(98, base_prob + (0.5 - savings_gap) * 60)
+            boosted = np.where(savings_gap < 0.2, np.maximum(boosted, 90), boosted)
+            basari_olasiligi = np.select(
+                [savings_gap <= 0.5, savings_gap <= 1.0],
+                [boosted, base_prob * (1.0 - ((savings_gap - 0.5) * 0.2))],
+                default=base_prob * (1.0 / (1.0 + (savings_gap - 1.0) * 2.0))
+            )
+        
+        income_share = required_monthly / max(avg_monthly_income, 1.0)
+        basari_olasiligi = np.where(income_share > 0.5, np.minimum(basari_olasiligi, 60), basari_olasiligi)
+        basari_olasiligi = np.where(income_share > 0.7, np.minimum(basari_olasiligi, 30), basari_olasiligi)
+            
+        basari_olasiligi = np.maximum(5, np.round(basari_olasiligi, 0))
+        
+        # Risk Level
+        base_risk = signals["risk_raw"] * 100
+        risk_seviyesi = np.select(
+            [savings_gap > 2.0, savings_gap > 1.5, savings_gap > 1.0],
+            [max(65, min(90, base_risk + 40)), max(45, min(75, base_risk + 25)), max(25, min(55, base_risk + 15))],
+            default=max(5, min(35, base_risk))
+        )
+            
+        risk_seviyesi = np.maximum(5, np.round(risk_seviyesi, 0))
+        risk_seviyesi = np.where(
+            basari_olasiligi + risk_seviyesi > 110, np.maximum(10, 105 - basari_olasiligi), risk_seviyesi
+        )
+        
+        return aylik_tasarruf, basari_olasiligi, risk_seviyesi
 
     # --- WORKER METHODS ---
     def get_result(self, goal_id: str):
-        with self.results_lock:
-            return self.results_cache.get(goal_id)
+        return self.results.get(goal_id)
     
-    def queue_request(self, user_data: ModelLockUserData):
-        self.request_queue.put(user_data)
+    @staticmethod
+    def request_key(user_data: ModelLockUserData):
+        goal_ids = tuple(sorted(user_data.goal_ids)) if user_data.goal_ids is not None else None
+        return (user_data.user_id, user_data.goal_id, user_data.goal_date, goal_ids)
+
+    def queue_request(self, user_data: ModelLockUserData) -> Future:
+        """
+        Queues a request and returns a Future resolved with its prompt result
+        ({goal_id: result} for multi-goal requests, None for training-only
+        requests or failures). If the same user/goal/goal_date (or goal list)
+        is already queued or running, nothing new is queued and the caller
+        shares that job's Future.
+        Raises AnalysisQueueFull when the queue holds AI_QUEUE_SIZE requests,
+        SharedModelNotReady while the shared model is being trained.
+        """
+        if self.model_mode == 'shared' and not self.ensure_shared_model():
+            with self.pending_lock:
+                self.metrics["requests"] += 1
+                self.metrics["rejected"] += 1
+            raise SharedModelNotReady("Budget analysis model is being trained, please try again later.")
+        
+        key = self.request_key(user_data)
+        with self.pending_lock:
+            self.metrics["requests"] += 1
+            job = self.pending_jobs.get(key)
+            if job is not None:
+                self.metrics["coalesced"] += 1
+                print(f"[AIService] Request merged into pending job for user: {user_data.user_id}, goal: {user_data.goal_id}")
+                return job
+            job = self.pending_jobs[key] = Future()
+            # Enqueued under the lock: nobody can join a job that is then rejected
+            try:
+                self.request_queue.put_nowait(user_data)
+            except Full:
+                del self.pending_jobs[key]
+                self.metrics["rejected"] += 1
+                raise AnalysisQueueFull("Budget analysis queue is full, please try again later.")
+            self.metrics["queued"] += 1
+
         print(f"[AIService] Request queued for user: {user_data.user_id}")
+        return job
+
+    def _complete_job(self, user_data: ModelLockUserData, result):
+        with self.pending_lock:
+            job = self.pending_jobs.pop(self.request_key(user_data), None)
+            self.metrics["processed"] += 1
+        if job is not None:
+            job.set_result(result)
+
+    def get_metrics(self) -> dict:
+        with self.pending_lock:
+            metrics = dict(self.metrics)
+            metrics["pending"] = len(self.pending_jobs)
+        metrics["queue_size"] = self.request_queue.qsize()
+        metrics["queue_limit"] = self.request_queue.maxsize
+        metrics["model_cache_hits"] = self.model_cache.hits
+        metrics["model_cache_misses"] = self.model_cache.misses
+        return metrics
 
     def start_worker(self, app=None):
         if self.worker_running:
@@ -545,68 +876,174 @@ class AIService:
         if app:
             self.app_instance = app
             
+        configure_torch_threads()
         self.worker_running = True
-        self.worker_thread = threading.Thread(target=self._worker, daemon=True)
-        self.worker_thread.start()
-        print("[AIService] Background worker started")
+        self.worker_threads = [
+            threading.Thread(target=self._worker, name=f"ai-worker-{i}", daemon=True)
+            for i in range(max(1, self.worker_count))
+        ]
+        for worker_thread in self.worker_threads:
+            worker_thread.start()
+        print(f"[AIService] {len(self.worker_threads)} background worker(s) started")
 
     def stop_worker(self):
         self.worker_running = False
-        if self.worker_thread:
-            self.worker_thread.join(timeout=5)
-        print("[AIService] Worker stopped")
+        for worker_thread in self.worker_threads:
+            worker_thread.join(timeout=5)
+        self.worker_threads = []
+        print("[AIService] Workers stopped")
 
     def _worker(self):
-        print("[AIService Worker] Started and waiting for requests...")
+        print(f"[AIService Worker] {threading.current_thread().name} started and waiting for requests...")
         
         while self.worker_running:
             try:
-                user_data = self.request_queue.get(timeout=1)
-                user_id = user_data.user_id
+                if self.model_mode == 'shared':
+                    batch = self._take_batch()
+                else:
+                    batch = [self.request_queue.get(timeout=1)]
+            except Empty:
+                continue
+
+            if self.model_mode == 'shared':
+                self._process_batch(batch)
+            else:
+                self._process_request(batch[0])
+
+    def _take_batch(self) -> list:
+        """Next queued request plus those arriving within batch_max_wait, up to batch_size."""
+        batch = [self.request_queue.get(timeout=1)]
+        deadline = time.monotonic() + self.batch_max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.request_queue.get(timeout=remaining))
+            except Empty:
+                break
+        return batch
+
+    def _process_request(self, user_data: ModelLockUserData):
+        result = None
+        try:
+            user_id = user_data.user_id
+            
+            print(f"\n[Worker] Processing request for user: {user_id}")
+            
+            if not self.app_instance:
+                print(f"[Worker] ERROR: No Flask app instance available!")
+                return
                 
-                print(f"\n[Worker] Processing request for user: {user_id}")
+            with self.app_instance.app_context(), self.get_user_lock(user_id):
+                needs_training = not self.is_trained(user_id)
                 
-                if not self.app_instance:
-                    print(f"[Worker] ERROR: No Flask app instance available!")
-                    continue
-                    
-                with self.app_instance.app_context():
-                    needs_training = not self.is_trained(user_id)
-                    
-                    if not needs_training:
-                        try:
-                            from models.transaction_model import UserTransaction
-                            from models.recurring_transaction_model import RecurringTransaction
-                            
-                            tx_count = UserTransaction.query.filter_by(user_id=user_id).count()
-                            rec_count = RecurringTransaction.query.filter_by(user_id=user_id).count()
-                            current_total = tx_count + rec_count
-                            
-                            metadata = self.get_metadata(user_id)
-                            last_count = metadata.get("training_count", 0)
-                            
-                            if current_total >= last_count * 2 and current_total > 5:
-                                print(f"[Worker] Data doubled ({last_count} -> {current_total}). Retraining...")
-                                needs_training = True
-                        except Exception as e:
-                            print(f"[Worker] Retraining check failed: {e}")
-                    
-                    if needs_training:
-                        print(f"[Worker] Starting training for {user_id}...")
-                        self.train(user_data)
+                if not needs_training:
+                    try:
+                        current_total = budget_features.get(user_id).data_points
                         
-                    if user_data.goal_id:
-                        if self.is_trained(user_id):
-                            print(f"[Worker] Running budget analysis for goal {user_data.goal_id}...")
-                            self.prompt(user_id, user_data.goal_id, user_data.goal_date)
-                        else:
-                            print(f"[Worker] ERROR: Training failed, cannot run inference.")
+                        metadata = self.get_metadata(user_id)
+                        last_count = metadata.get("training_count", 0)
+                        
+                        if current_total >= last_count * 2 and current_total > 5:
+                            print(f"[Worker] Data doubled ({last_count} -> {current_total}). Retraining...")
+                            needs_training = True
+                    except Exception as e:
+                        print(f"[Worker] Retraining check failed: {e}")
                 
+                if needs_training:
+                    print(f"[Worker] Starting training for {user_id}...")
+                    self.train(user_data)
+                    
+                if user_data.goal_id or user_data.goal_ids is not None:
+                    if not self.is_trained(user_id):
+                        print(f"[Worker] ERROR: Training failed, cannot run inference.")
+                    elif user_data.goal_ids is not None:
+                        print(f"[Worker] Running budget analysis for {len(user_data.goal_ids)} goals...")
+                        result = self.prompt_goals(user_id, user_data.goal_ids)
+                    else:
+                        print(f"[Worker] Running budget analysis for goal {user_data.goal_id}...")
+                        result = self.prompt(user_id, user_data.goal_id, user_data.goal_date)
+            
+        except Exception as e:
+            print(f"[Worker] Error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            # Callers merged into this job get the same result
+            self._complete_job(user_data, result)
+            self.request_queue.task_done()
+
+    def ensure_shared_model(self) -> bool:
+        """
+        True if the shared model is trained. Otherwise starts training it once
+        on a background thread (when `flask train_shared_model` has not been
+        run yet) and returns False; the workers never train it inline.
+        """
+        if self.is_trained(SHARED_MODEL_KEY):
+            return True
+        with self.shared_training_guard:
+            if self.shared_training_thread is None or not self.shared_training_thread.is_alive():
+                if not self.app_instance:
+                    print("[AIService] ERROR: No Flask app instance to train the shared model in!")
+                    return False
+                print("[AIService] Shared model not trained yet, training it in the background...")
+                self.shared_training_thread = threading.Thread(
+                    target=self._train_shared_in_background, name="ai-shared-training", daemon=True
+                )
+                self.shared_training_thread.start()
+        return False
+
+    def _train_shared_in_background(self):
+        try:
+            with self.app_instance.app_context(), self.training_slots:
+                self.train_shared()
+        except Exception as e:
+            print(f"[Shared] Training failed: {str(e)}")
+            import traceback
+            traceback.print_exc()
+
+    def _process_batch(self, batch: list):
+        """
+        Shared model: answers several users' requests with one forward pass.
+        The shared model is trained offline (or in the background on first
+        use, see ensure_shared_model), so nothing is trained here.
+        """
+        results = [None] * len(batch)
+        try:
+            print(f"\n[Worker] Processing batch of {len(batch)} request(s)")
+            with self.pending_lock:
+                self.metrics["batches"] += 1
+            
+            if not self.app_instance:
+                print(f"[Worker] ERROR: No Flask app instance available!")
+                return
+            
+            requests = []
+            for user_data in batch:
+                if user_data.goal_ids is not None:
+                    requests.append((user_data.user_id, user_data.goal_ids, None))
+                elif user_data.goal_id:
+                    goal_dates = {user_data.goal_id: user_data.goal_date} if user_data.goal_date else None
+                    requests.append((user_data.user_id, [user_data.goal_id], goal_dates))
+                else:
+                    requests.append(None)  # Training-only request: the shared model is trained offline
+            
+            with self.app_instance.app_context():
+                outputs = self.prompt_batch(requests)
+            
+            for i, user_data in enumerate(batch):
+                # Single-goal requests resolve to the goal's result, like prompt()
+                if outputs[i] is not None and user_data.goal_ids is None:
+                    results[i] = outputs[i].get(user_data.goal_id)
+                else:
+                    results[i] = outputs[i]
+            
+        except Exception as e:
+            print(f"[Worker] Error: {str(e)}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            for user_data, result in zip(batch, results):
+                self._complete_job(user_data, result)
                 self.request_queue.task_done()
-                
-            except Exception as e:
-                if "Empty" not in str(type(e).__name__):
-                    print(f"[Worker] Error: {str(e)}")
-                    import traceback
-                    traceback.print_exc()
-                continue
@@ -0,0 +1,156 @@
+# services/ai_result_store_service.py
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from database.db import db
+from models.ai_result_model import BudgetAnalysisResult
+
+# memory: per-process LRU; database: budget_analysis_results table shared by all workers
+AI_RESULT_STORE = os.getenv('AI_RESULT_STORE', 'memory')
+AI_RESULT_STORE_SIZE = int(os.getenv('AI_RESULT_STORE_SIZE', '1000'))
+AI_RESULT_TTL_SECONDS = int(os.getenv('AI_RESULT_TTL_SECONDS', '3600'))
+
+
+class MemoryResultBackend:
+    """LRU of results in this process; entries expire ttl_seconds after they were stored."""
+
+    def __init__(self, max_entries=AI_RESULT_STORE_SIZE, ttl_seconds=AI_RESULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # goal_id -> (stored_at, user_id, versions, result)
+        self._lock = threading.Lock()
+
+    def get(self, goal_id):
+        with self._lock:
+            entry = self._entries.get(goal_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[goal_id]
+                return None
+            self._entries.move_to_end(goal_id)
+            return entry[1:]
+
+    def put(self, goal_id, user_id, versions, result):
+        with self._lock:
+            self._entries[goal_id] = (time.monotonic(), user_id, versions, result)
+            self._entries.move_to_end(goal_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, goal_id):
+        with self._lock:
+            self._entries.pop(goal_id, None)
+
+
+class DatabaseResultBackend:
+    """
+    Results in the budget_analysis_results table, so every server process
+    sees the same results. Uses its own short sessions: reading or storing a
+    result never commits (or rolls back) the caller's transaction.
+    """
+
+    def __init__(self, max_entries=AI_RESULT_STORE_SIZE, ttl_seconds=AI_RESULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, goal_id):
+        with Session(db.engine) as session:
+            row = session.get(BudgetAnalysisResult, goal_id)
+            if row is None:
+                return None
+            now = datetime.utcnow()
+            if now - row.created_at > timedelta(seconds=self.ttl_seconds):
+                session.delete(row)
+                session.commit()
+                return None
+            entry = (row.user_id, json.loads(row.versions), json.loads(row.result))
+            session.execute(
+                update(BudgetAnalysisResult)
+                .where(BudgetAnalysisResult.goal_id == goal_id)
+                .values(accessed_at=now)
+            )
+            session.commit()
+            return entry
+
+    def put(self, goal_id, user_id, versions, result):
+        now = datetime.utcnow()
+        with Session(db.engine) as session:
+            session.merge(BudgetAnalysisResult(
+                goal_id=goal_id,
+                user_id=user_id,
+                versions=json.dumps(versions),
+                result=json.dumps(result),
+                created_at=now,
+                accessed_at=now
+            ))
+            session.flush()
+            # Drop expired rows and everything past the newest max_entries by access time
+            session.execute(
+                delete(BudgetAnalysisResult)
+                .where(BudgetAnalysisResult.created_at < now - timedelta(seconds=self.ttl_seconds))
+            )
+            evicted = (
+                select(BudgetAnalysisResult.goal_id)
+                .order_by(BudgetAnalysisResult.accessed_at.desc())
+                .offset(self.max_entries)
+            )
+            session.execute(
+                delete(BudgetAnalysisResult)
+                .where(BudgetAnalysisResult.goal_id.in_(evicted.scalar_subquery()))
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+
+    def delete(self, goal_id):
+        with Session(db.engine) as session:
+            session.execute(delete(BudgetAnalysisResult).where(BudgetAnalysisResult.goal_id == goal_id))
+            session.commit()
+
+
+RESULT_BACKENDS = {
+    'memory': MemoryResultBackend,
+    'database': DatabaseResultBackend,
+}
+
+
+def create_result_backend(name=None):
+    name = name or AI_RESULT_STORE
+    if name not in RESULT_BACKENDS:
+        raise ValueError(f"Unknown AI_RESULT_STORE '{name}', expected one of: {', '.join(RESULT_BACKENDS)}")
+    return RESULT_BACKENDS[name]()
+
+
+class AnalysisResultStore:
+    """
+    Budget analysis results by goal_id, stored with the versions they were
+    computed from. versions_for(user_id) returns the user's current versions
+    (data version counters, model version); a stored result is served only
+    while they are unchanged. Transaction, recurring and goal writes bump the
+    counters, so such a write invalidates the user's results in every process.
+    """
+
+    def __init__(self, versions_for, backend=None):
+        self.versions_for = versions_for
+        self.backend = backend or create_result_backend()
+
+    def get(self, goal_id):
+        entry = self.backend.get(goal_id)
+        if entry is None:
+            return None
+        user_id, versions, result = entry
+        if versions != self.versions_for(user_id):
+            self.backend.delete(goal_id)
+            return None
+        return result
+
+    def put(self, goal_id, user_id, versions, result):
+        self.backend.put(goal_id, user_id, versions, result)
@@ -0,0 +1,224 @@
+# services/anomaly_check_service.py
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from database.db import db
+from services.category_service import CategoryService
+from services.firebase_service import FirebaseService
+from services.anomaly_client import anomaly_client
+from services.anomaly_engine import ANOMALY_ENGINE, inprocess_engine
+from services.data_version_service import DataVersionService
+from services.transaction_cache_service import transaction_cache, _is_income, _naive
+from models.transaction_model import UserTransaction
+from repositories.transaction_anomaly_repository import TransactionAnomalyRepository
+
+# Anomaly checks run off the request thread on this executor
+ANOMALY_CHECK_WORKERS = int(os.getenv('ANOMALY_CHECK_WORKERS', '4'))
+_check_executor = ThreadPoolExecutor(max_workers=ANOMALY_CHECK_WORKERS, thread_name_prefix='anomaly-check')
+
+PENDING_MESSAGE = "Anomali kontrolü arka planda yapılıyor."
+
+
+class HistorySyncState:
+    """
+    Remembers, per user, the history version the anomaly service last
+    acknowledged together with the user's transaction data version
+    (DataVersionService) that history was read at. If the only write since
+    then is the transaction being checked, the next check sends just that
+    row; otherwise the full history is sent again.
+    """
+
+    def __init__(self, max_users=1000):
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> (history_version, data_version)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            synced = self._users.get(user_id)
+            if synced is not None:
+                self._users.move_to_end(user_id)
+            return synced
+
+    def put(self, user_id, history_version, data_version):
+        with self._lock:
+            self._users[user_id] = (history_version, data_version)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def drop(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+history_sync_state = HistorySyncState()
+
+
+class AnomalyCheckService:
+    """
+    Sends a newly created transaction to the anomaly service together with
+    the user's history. After the first full sync only the new transaction
+    is sent as a versioned delta, as long as nothing else was written since;
+    if the anomaly service reports a different version (restart, eviction,
+    another server process) the full history is resent.
+    """
+
+    def __init__(self):
+        self.categoryService = CategoryService()
+        self.anomalyRepository = TransactionAnomalyRepository()
+
+    def _category_map(self):
+        # frontend category_id olarak isim gönderiyor → map name:name
+        return {cat.name: cat.name for cat in self.categoryService.get_all_categories()}
+
+    @staticmethod
+    def _record(transaction_id, date, amount, tx_type, category_id, all_categories_map):
+        return {
+            "id": transaction_id,
+            "date": date.isoformat(),
+            "amount": amount,
+            "type": str(tx_type),
+            "category": all_categories_map.get(category_id, 'Other')
+        }
+
+    def _history_records(self, user_id, all_categories_map):
+        columns = transaction_cache.get(user_id)
+        return [
+            self._record(*row, all_categories_map)
+            for row in zip(
+                columns.ids, columns.date.tolist(), columns.amount.tolist(), columns.type_names(), columns.category_ids()
+            )
+        ]
+
+    def _transaction_record(self, transaction_id, all_categories_map):
+        """The stored transaction as a history record (same values as _history_records), or None."""
+        transaction = db.session.get(UserTransaction, transaction_id)
+        if transaction is None:
+            return None
+        return self._record(
+            transaction.id, _naive(transaction.date), float(transaction.amount),
+            'income' if _is_income(transaction.type) else 'expense', transaction.category_id, all_categories_map
+        )
+
+    def _history_delta(self, user_id, transaction_id, written_version, data_version, all_categories_map):
+        """
+        Delta from the synced history, or None when a full resync is needed.
+        O(1): the data versions show whether the new transaction is the only write since the sync.
+        """
+        synced = history_sync_state.get(user_id)
+        if synced is None:
+            return None
+        base_version, synced_data_version = synced
+        if data_version == synced_data_version:
+            return {"base_version": base_version, "upserts": [], "deletes": []}
+        # The transaction's own insert must be the one bump after the synced version
+        if transaction_id is None or not written_version == data_version == synced_data_version + 1:
+            return None
+        record = self._transaction_record(transaction_id, all_categories_map)
+        if record is None:
+            return None
+        return {"base_version": base_version, "upserts": [record], "deletes": []}
+
+    def _post(self, payload, auth_header):
+        if ANOMALY_ENGINE == 'inprocess':
+            return inprocess_engine.post(payload, auth_header)
+        return anomaly_client.post(payload, auth_header)
+
+    def check_new_transaction(self, user_id, data, auth_header, transaction_id=None, written_version=None):
+        """
+        Returns the anomaly service verdict for a transaction that has already
+        been stored, or a fallback verdict when the service is unavailable.
+        `written_version` is the transaction data version the insert committed at.
+        """
+        try:
+            all_categories_map = self._category_map()
+            # Read before the history: a write in between only causes a resync next time
+            data_version = DataVersionService.get_version(user_id, 'transactions')
+
+            anomaly_payload = {
+                "user_id": user_id,
+                "new_transaction": {
+                    "date": data.get('date', datetime.now().isoformat()),
+                    "amount": data.get('amount'),
+                    "category": all_categories_map.get(data.get('category_id'), 'Other'),
+                    "type": data.get('type')
+                }
+            }
+
+            history_delta = self._history_delta(
+                user_id, transaction_id, written_version, data_version, all_categories_map
+            )
+            if history_delta is not None:
+                anomaly_payload["history_delta"] = history_delta
+            else:
+                anomaly_payload["user_history"] = self._history_records(user_id, all_categories_map)
+
+            print(f"[DEBUG] Anomali kontrolü gönderiliyor (engine: {ANOMALY_ENGINE})...")
+            response = self._post(anomaly_payload, auth_header)
+
+            if response.status_code == 409 and "history_delta" in anomaly_payload:
+                # Versions diverged: fall back to a full resync
+                print(f"[DEBUG] Anomali geçmiş sürümü uyuşmadı, tam senkronizasyon yapılıyor ({user_id})")
+                del anomaly_payload["history_delta"]
+                anomaly_payload["user_history"] = self._history_records(user_id, all_categories_map)
+                response = self._post(anomaly_payload, auth_header)
+
+            if response.status_code == 200:
+                anomaly_response_json = response.json()
+                history_version = anomaly_response_json.pop("history_version", None)
+                if history_version:
+                    history_sync_state.put(user_id, history_version, data_version)
+                else:
+                    history_sync_state.drop(user_id)
+                print(f"[DEBUG] Anomali sonucu: {anomaly_response_json.get('message')}")
+                return anomaly_response_json
+
+            print(f"Anomali Servisi Hatası: {response.status_code} - {response.text}")
+            history_sync_state.drop(user_id)
+            return {"is_anomaly": None, "message": "Anomali servisi yanıt vermiyor."}
+
+        except requests.exceptions.RequestException as e:
+            # Includes CircuitOpenError: the service is known to be down, fail fast
+            print(f"Anomali Servisi Bağlantı Hatası: {e}")
+            history_sync_state.drop(user_id)
+            return {"is_anomaly": None, "message": "Anomali servisine bağlanılamadı."}
+
+    def submit_check(self, app, user_id, transaction_id, data, auth_header, written_version=None):
+        """
+        Stores a pending verdict for an already committed transaction and runs
+        the anomaly check on the background executor. Returns the pending verdict.
+        """
+        pending = self.anomalyRepository.create_pending(transaction_id, user_id, PENDING_MESSAGE)
+        _check_executor.submit(
+            self._run_check, app, user_id, transaction_id, dict(data), auth_header, written_version
+        )
+        return pending.serialize()
+
+    def _run_check(self, app, user_id, transaction_id, data, auth_header, written_version=None):
+        with app.app_context():
+            try:
+                verdict = self.check_new_transaction(user_id, data, auth_header, transaction_id, written_version)
+                is_anomaly = verdict.get('is_anomaly')
+                status = 'failed' if is_anomaly is None else 'done'
+                anomaly = self.anomalyRepository.save_verdict(
+                    transaction_id, is_anomaly, verdict.get('message'), status, verdict.get('score')
+                )
+                if anomaly and is_anomaly:
+                    self._notify(user_id, transaction_id, anomaly.message)
+            except Exception as e:
+                print(f"[AnomalyCheck] Background check failed for {transaction_id}: {e}")
+                db.session.rollback()
+                self.anomalyRepository.save_verdict(transaction_id, None, "Anomali kontrolü yapılamadı.", 'failed')
+
+    def _notify(self, user_id, transaction_id, message):
+        from models.user_model import User
+        user = User.query.get(user_id)
+        if user and user.fcm_token:
+            FirebaseService.send_anomaly_notification(user.fcm_token, transaction_id, message)
@@ -0,0 +1,144 @@
+# services/anomaly_client.py
+
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+ANOMALY_SERVICE_URL = os.getenv('ANOMALY_SERVICE_URL', "http://127.0.0.1:5002/api/anomaly/check-transaction")
+
+# Responses that mean the service is down (503 only without Retry-After, see is_outage_response)
+OUTAGE_STATUS_CODES = {500, 502, 503, 504}
+
+
+def is_outage_response(response):
+    """
+    True for responses that count toward opening the circuit. A 503 with
+    Retry-After is the service's deliberate backpressure (its model fit queue
+    is full), not an outage: the service is up and answers other users.
+    """
+    if response.status_code == 503 and 'Retry-After' in response.headers:
+        return False
+    return response.status_code in OUTAGE_STATUS_CODES
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without touching the network while the anomaly service is considered down."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast after `failure_threshold` consecutive failures.
+
+    closed    -> requests flow normally
+    open      -> requests are rejected until `reset_timeout` seconds have passed
+    half_open -> a single probe request is let through; success closes the
+                 breaker, failure opens it again
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # HALF_OPEN: only one probe at a time
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                print("[AnomalyClient] Anomaly service recovered, closing circuit")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_backpressure(self):
+        # The service answered: neither a failure nor proof of recovery
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"[AnomalyClient] Opening circuit after {self.failures} failure(s)")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class AnomalyServiceClient:
+    """
+    Shared keep-alive HTTP client for the anomaly service.
+    Connections are pooled and reused across requests and threads, and a
+    circuit breaker stops calls while the service is down.
+    """
+
+    def __init__(self, url=ANOMALY_SERVICE_URL, pool_size=None, connect_timeout=None, read_timeout=None,
+                 failure_threshold=None, reset_timeout=None):
+        self.url = url
+        pool_size = pool_size or int(os.getenv('ANOMALY_HTTP_POOL_SIZE', '10'))
+        self.timeout = (
+            connect_timeout or float(os.getenv('ANOMALY_HTTP_CONNECT_TIMEOUT', '2')),
+            read_timeout or float(os.getenv('ANOMALY_HTTP_READ_TIMEOUT', '10'))
+        )
+        self.breaker = CircuitBreaker(
+            failure_threshold=failure_threshold or int(os.getenv('ANOMALY_BREAKER_FAILURES', '5')),
+            reset_timeout=reset_timeout or float(os.getenv('ANOMALY_BREAKER_RESET_SECONDS', '30'))
+        )
+
+        self.session = requests.Session()
+        # No transparent retries: the breaker decides when to try again
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+    def post(self, payload, auth_header=None):
+        if not self.breaker.allow_request():
+            raise CircuitOpenError("Anomaly service circuit is open")
+
+        headers = {"Authorization": auth_header} if auth_header else None
+        try:
+            response = self.session.post(self.url, headers=headers, json=payload, timeout=self.timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            # Not a sign of an outage (e.g. an unserializable payload)
+            self.breaker.record_backpressure()
+            raise
+
+        if is_outage_response(response):
+            self.breaker.record_failure()
+        elif response.status_code == 503:
+            self.breaker.record_backpressure()
+        else:
+            self.breaker.record_success()
+        return response
+
+
+anomaly_client = AnomalyServiceClient()
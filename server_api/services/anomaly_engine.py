@@ -0,0 +1,100 @@
+# services/anomaly_engine.py
+
+import importlib.util
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+
+# http      -> call the standalone anomaly_api service (default)
+# inprocess -> load anomaly_api's UserAnomalyModel into this process and skip the network hop
+ANOMALY_ENGINE = os.getenv('ANOMALY_ENGINE', 'http').lower()
+
+ANOMALY_ENGINE_MODULE_PATH = os.getenv(
+    'ANOMALY_ENGINE_MODULE_PATH',
+    str(Path(__file__).resolve().parents[2] / 'anomaly_api' / 'app' / 'services' / 'anomaly_detection_service.py')
+)
+
+
+class EngineResponse:
+    """Minimal stand-in for requests.Response so callers can treat both engines alike."""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+    @property
+    def text(self):
+        return json.dumps(self._body, ensure_ascii=False)
+
+
+class InProcessAnomalyEngine:
+    """
+    Runs anomaly_api's AnomalyDetectionService inside server_api.
+
+    The module is loaded from ANOMALY_ENGINE_MODULE_PATH (it only depends on
+    pandas/numpy/scikit-learn, not on anomaly_api's Flask app) and called with
+    the same payload the HTTP endpoint accepts, returning the same
+    is_anomaly/message/score/history_version contract.
+    """
+
+    _module_name = 'anomaly_detection_service'
+
+    def __init__(self, module_path=ANOMALY_ENGINE_MODULE_PATH):
+        self.module_path = module_path
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    spec = importlib.util.spec_from_file_location(self._module_name, self.module_path)
+                    module = importlib.util.module_from_spec(spec)
+                    # Registered so fitted models can be pickled by module name
+                    sys.modules[self._module_name] = module
+                    spec.loader.exec_module(module)
+                    self._module = module
+                    print(f"[AnomalyEngine] In-process anomaly engine loaded from {self.module_path}")
+        return self._module
+
+    def post(self, payload, auth_header=None):
+        module = self._load()
+        user_id = payload.get('user_id')
+        try:
+            is_anomaly, message, score, history_version = module.anomaly_service.check_transaction(
+                payload.get('user_history'),
+                payload['new_transaction'],
+                user_id=user_id,
+                history_version=payload.get('history_version'),
+                history_delta=payload.get('history_delta')
+            )
+            return EngineResponse(200, {
+                "is_anomaly": is_anomaly,
+                "message": message,
+                "score": score,
+                "history_version": history_version,
+                "user_id": user_id
+            })
+        except module.HistoryVersionMismatch as e:
+            return EngineResponse(409, {
+                "error": str(e),
+                "resync_required": True,
+                "history_version": e.current_version
+            })
+        except module.ModelFitBusy as e:
+            # Model fit queue is full; the caller treats this like an unavailable service
+            return EngineResponse(503, {"error": str(e)})
+        except ValueError as e:
+            # Same as the HTTP route: bad input is a warning, not an anomaly
+            return EngineResponse(200, {"is_anomaly": False, "message": str(e), "user_id": user_id})
+        except Exception as e:
+            print(f"HATA (In-process Anomaly Engine): {str(e)}")
+            return EngineResponse(500, {"error": "Anomali tespiti yapılırken bir sunucu hatası oluştu."})
+
+
+inprocess_engine = InProcessAnomalyEngine()
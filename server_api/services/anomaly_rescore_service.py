@@ -0,0 +1,198 @@
+# services/anomaly_rescore_service.py
+
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, groupby
+
+from sqlalchemy.orm import Session
+
+from database.db import db
+from models.transaction_model import UserTransaction
+from repositories.transaction_anomaly_repository import TransactionAnomalyRepository
+from services.anomaly_scoring_service import build_transaction_records, score_transactions, verdict_mappings
+
+ANOMALY_RESCORE_CHECKPOINT = os.getenv('ANOMALY_RESCORE_CHECKPOINT', 'anomaly_rescore_checkpoint.json')
+
+
+def _score_user(user_id, transaction_data):
+    # Runs in a worker process: plain dicts in, plain lists out
+    flags, scores = score_transactions(transaction_data)
+    return [record["id"] for record in transaction_data], flags, scores
+
+
+class RescoreCheckpoint:
+    """
+    The last user whose verdicts are committed, plus running totals.
+    Written to a temp file and renamed so an interruption never leaves a
+    half-written checkpoint behind.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def save(self, state):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class AnomalyRescoreJob:
+    """
+    Re-scores every user's transactions with the same Isolation Forest as
+    POST /anomaly and stores the verdicts in transaction_anomalies.
+
+    Transactions are streamed ordered by user with a server-side cursor
+    (yield_per), each user is fitted and scored on a worker process, and
+    verdicts are written in bulk every `flush_users` users. Users are
+    completed in id order, so the checkpoint is simply the last user written;
+    a rerun continues after it. Users whose scoring failed are kept in the
+    checkpoint apart from that cursor: a resumed run retries the ones before
+    the cursor, and a completed pass with failures leaves a checkpoint with
+    only the failed users, so the next run is a full pass again.
+    """
+
+    def __init__(self, workers=None, yield_per=1000, flush_users=50, checkpoint_path=ANOMALY_RESCORE_CHECKPOINT,
+                 report_every=100):
+        self.workers = workers or os.cpu_count() or 1
+        self.yield_per = yield_per
+        self.flush_users = flush_users
+        self.report_every = report_every
+        self.checkpoint = RescoreCheckpoint(checkpoint_path)
+        self.anomalyRepository = TransactionAnomalyRepository()
+
+    def _stream_users(self, read_session, after_user_id=None, user_ids=None):
+        query = read_session.query(UserTransaction)
+        if after_user_id is not None:
+            query = query.filter(UserTransaction.user_id > after_user_id)
+        if user_ids is not None:
+            query = query.filter(UserTransaction.user_id.in_(user_ids))
+        query = query.order_by(UserTransaction.user_id, UserTransaction.id).yield_per(self.yield_per)
+
+        for user_id, transactions in groupby(query, key=lambda t: t.user_id):
+            yield user_id, build_transaction_records(transactions)
+
+    def run(self, restart=False):
+        """Runs (or resumes) the job and returns a summary with throughput figures."""
+        if restart:
+            self.checkpoint.clear()
+        state = self.checkpoint.load() or {"last_user_id": None}
+        resuming = state["last_user_id"] is not None
+        if resuming:
+            print(f"[Rescore] Resuming after user {state['last_user_id']} ({state['users']} users already done)")
+        else:
+            # New full pass; only the failed users of the previous pass are carried over
+            state = {"last_user_id": None, "users": 0, "transactions": 0, "anomalies": 0,
+                     "failed_user_ids": state.get("failed_user_ids", [])}
+        state.setdefault("failed_user_ids", [])
+        previously_failed = list(state["failed_user_ids"])
+        if previously_failed:
+            print(f"[Rescore] Retrying {len(previously_failed)} previously failed user(s)")
+
+        self._state = state
+        self._run_counts = {"users": 0, "transactions": 0}
+        self._buffer = []
+        self._buffered_users = 0
+        self._seen_user_ids = set()
+        self._started = time.monotonic()
+
+        # spawn: workers must not inherit the app's threads or DB connections
+        mp_context = multiprocessing.get_context('spawn')
+        in_flight = deque()
+        with Session(db.engine) as read_session, \
+                ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context) as pool:
+            users = self._stream_users(read_session, state["last_user_id"])
+            if resuming and previously_failed:
+                # Failed before the cursor: a full pass would have come back to them
+                users = chain(self._stream_users(read_session, user_ids=previously_failed), users)
+            for user_id, records in users:
+                in_flight.append((user_id, pool.submit(_score_user, user_id, records)))
+                # Keep a bounded number of users in memory; collect in submission order
+                if len(in_flight) >= self.workers * 2:
+                    self._collect(*in_flight.popleft())
+            while in_flight:
+                self._collect(*in_flight.popleft())
+        # A failed user whose transactions are all gone has nothing left to retry
+        self._state["failed_user_ids"] = [
+            user_id for user_id in self._state["failed_user_ids"]
+            if user_id not in previously_failed or user_id in self._seen_user_ids
+        ]
+        self._flush()
+
+        summary = self._summary()
+        if self._state["failed_user_ids"]:
+            # Pass complete: drop the cursor, keep the failed users for the next pass
+            self.checkpoint.save({"last_user_id": None, "failed_user_ids": self._state["failed_user_ids"]})
+        else:
+            self.checkpoint.clear()
+        return summary
+
+    def _collect(self, user_id, future):
+        self._seen_user_ids.add(user_id)
+        failed_user_ids = self._state["failed_user_ids"]
+        try:
+            transaction_ids, flags, scores = future.result()
+        except Exception as e:
+            print(f"[Rescore] Scoring failed for user {user_id}: {e}")
+            if user_id not in failed_user_ids:
+                failed_user_ids.append(user_id)
+            transaction_ids, flags, scores = [], [], []
+        else:
+            if user_id in failed_user_ids:
+                failed_user_ids.remove(user_id)
+            self._state["users"] += 1
+
+        self._buffer.extend(verdict_mappings(user_id, transaction_ids, flags, scores))
+
+        # Retried users come before the resume point: the checkpoint never moves back
+        if self._state["last_user_id"] is None or user_id > self._state["last_user_id"]:
+            self._state["last_user_id"] = user_id
+        self._state["transactions"] += len(transaction_ids)
+        self._state["anomalies"] += sum(flags)
+        self._run_counts["users"] += 1
+        self._run_counts["transactions"] += len(transaction_ids)
+        self._buffered_users += 1
+
+        if self._buffered_users >= self.flush_users:
+            self._flush()
+        if self._run_counts["users"] % self.report_every == 0:
+            self._report()
+
+    def _flush(self):
+        # Checkpoint only moves after the verdicts are committed
+        self.anomalyRepository.bulk_upsert(self._buffer)
+        self.checkpoint.save(self._state)
+        self._buffer = []
+        self._buffered_users = 0
+
+    def _summary(self):
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            "users": self._state["users"],
+            "transactions": self._state["transactions"],
+            "anomalies": self._state["anomalies"],
+            "failed_users": len(self._state["failed_user_ids"]),
+            "elapsed_seconds": round(elapsed, 2),
+            "users_per_second": round(self._run_counts["users"] / elapsed, 2),
+            "transactions_per_second": round(self._run_counts["transactions"] / elapsed, 2)
+        }
+
+    def _report(self):
+        summary = self._summary()
+        print(f"[Rescore] {summary['users']} users, {summary['transactions']} transactions, "
+              f"{summary['anomalies']} anomalies | {summary['users_per_second']} users/s, "
+              f"{summary['transactions_per_second']} transactions/s")
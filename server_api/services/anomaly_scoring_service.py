@@ -0,0 +1,197 @@
+# services/anomaly_scoring_service.py
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+
+from models.transaction_model import TransactionType
+from repositories.transaction_anomaly_repository import TransactionAnomalyRepository
+from services.transaction_cache_service import transaction_cache
+
+FEATURE_COLUMNS = ['amount', 'day_of_week', 'day_of_month', 'month', 'type_encoded', 'category_encoded']
+
+ANOMALY_MESSAGE = "Toplu taramada olağan dışı bir işlem olarak işaretlendi."
+NORMAL_MESSAGE = "Toplu taramada normal görünüyor."
+
+
+def transaction_record(transaction, index=0):
+    """Converts a transaction into the JSON-safe dict used for scoring and responses."""
+    # 1. 'type' (Enum) nesnesini güvenle string'e çevir
+    tx_type_obj = getattr(transaction, 'type', TransactionType.expense)
+    tx_type_str = tx_type_obj.name if isinstance(tx_type_obj, TransactionType) else str(tx_type_obj)
+
+    # 2. 'category' (Kategori nesnesi olabilir) güvenle string'e çevir
+    cat_obj = getattr(transaction, 'category', 'General')  # Varsayılan 'General'
+    cat_str = cat_obj.name if hasattr(cat_obj, 'name') and not isinstance(cat_obj, str) else str(cat_obj)
+
+    # 3. 'date' (datetime) nesnesini JSON uyumlu string'e (ISO format) çevir
+    date_obj = transaction.date if hasattr(transaction, 'date') else None
+    date_str = date_obj.isoformat() if date_obj else None
+
+    # 4. 'id'yi güvenle al
+    tx_id = getattr(transaction, 'id', f"index_{index}")  # ID yoksa geçici index kullan
+
+    return {
+        "id": tx_id,
+        "date": date_str,
+        "amount": float(getattr(transaction, 'amount', 0.0)),
+        "type": tx_type_str,
+        "category": cat_str
+    }
+
+
+def build_transaction_records(transactions):
+    return [transaction_record(transaction, i) for i, transaction in enumerate(transactions)]
+
+
+def build_records_from_columns(columns):
+    """Same records as build_transaction_records, from the columnar transaction cache."""
+    return [
+        {
+            "id": transaction_id,
+            "date": date.isoformat() if date else None,
+            "amount": float(amount),
+            "type": str(tx_type),
+            # UserTransaction has no 'category' relationship, so transaction_record
+            # has always fallen back to this placeholder
+            "category": 'General'
+        }
+        for transaction_id, date, amount, tx_type in zip(
+            columns.ids, columns.date.tolist(), columns.amount, columns.type_names()
+        )
+    ]
+
+
+def score_transactions(transaction_data):
+    """
+    Fits an Isolation Forest on one user's transactions and scores them.
+    Returns (is_anomaly, score) lists in input order; lower scores are more anomalous.
+
+    Plain function on plain dicts so it can also run in worker processes.
+    """
+    df = pd.DataFrame(transaction_data)
+
+    # Feature engineering
+    if 'date' in df.columns and df['date'].notna().any():
+        df['date'] = pd.to_datetime(df['date'], errors='coerce')
+        df['day_of_week'] = df['date'].dt.dayofweek.fillna(0)
+        df['day_of_month'] = df['date'].dt.day.fillna(1)
+        df['month'] = df['date'].dt.month.fillna(1)
+    else:
+        df['day_of_week'] = 0
+        df['day_of_month'] = 1
+        df['month'] = 1
+
+    # Encode categorical variables
+    df['type_encoded'] = df['type'].map({'income': 1, 'expense': 0, 'Income': 1, 'Expense': 0}).fillna(0)
+    df['category_encoded'] = df['category'].astype('category').cat.codes
+
+    X = df[FEATURE_COLUMNS].values
+
+    iso_forest = IsolationForest(
+        contamination=0.1,
+        random_state=42,
+        n_estimators=100
+    )
+
+    # -1 anomali demektir
+    anomaly_labels = iso_forest.fit_predict(X)
+    scores = iso_forest.decision_function(X)
+
+    return [bool(label == -1) for label in anomaly_labels], [float(score) for score in scores]
+
+
+def verdict_mappings(user_id, transaction_ids, flags, scores, checked_at=None):
+    """Rows for TransactionAnomalyRepository.bulk_upsert from a full-history scoring run."""
+    checked_at = checked_at or datetime.utcnow()
+    return [
+        {
+            "transaction_id": transaction_id,
+            "user_id": user_id,
+            "status": 'done',
+            "is_anomaly": is_anomaly,
+            "score": score,
+            "message": ANOMALY_MESSAGE if is_anomaly else NORMAL_MESSAGE,
+            "source": 'batch',
+            "checked_at": checked_at
+        }
+        for transaction_id, is_anomaly, score in zip(transaction_ids, flags, scores)
+    ]
+
+
+class AnomalyResultCache:
+    """
+    POST /anomaly results per user, stored with the transaction-set version
+    they were computed from. A result is served only while the user's
+    version is unchanged; any create, update or delete bumps the version.
+    """
+
+    def __init__(self, max_users=None):
+        if max_users is None:
+            max_users = int(os.getenv('ANOMALY_RESULT_CACHE_USERS', '1000'))
+        self.max_users = max_users
+        self._results = OrderedDict()  # user_id -> (version, result)
+        self._lock = threading.Lock()
+
+    def get(self, user_id, version):
+        with self._lock:
+            cached = self._results.get(user_id)
+            if cached is None or cached[0] != version:
+                return None
+            self._results.move_to_end(user_id)
+            return cached[1]
+
+    def put(self, user_id, version, result):
+        with self._lock:
+            self._results[user_id] = (version, result)
+            self._results.move_to_end(user_id)
+            while len(self._results) > self.max_users:
+                self._results.popitem(last=False)
+
+
+anomaly_result_cache = AnomalyResultCache()
+
+
+def detect_user_anomalies(user_id):
+    """
+    Returns the anomaly result for all of a user's transactions, reusing the
+    cached result while the user's transaction version has not changed.
+    The result has 'total_transactions' and 'anomalies' (anomalous records,
+    with 'transaction_id' instead of 'id'). Fresh verdicts are also stored
+    on the transactions (transaction_anomalies).
+    """
+    # The columns carry the transaction version they were read at
+    columns = transaction_cache.get(user_id)
+    version = columns.version
+    cached = anomaly_result_cache.get(user_id, version)
+    if cached is not None:
+        return cached
+
+    transaction_data = build_records_from_columns(columns)
+
+    anomalies = []
+    if transaction_data:
+        anomaly_flags, scores = score_transactions(transaction_data)
+        TransactionAnomalyRepository.bulk_upsert(
+            verdict_mappings(user_id, [r["id"] for r in transaction_data], anomaly_flags, scores)
+        )
+
+        # 'transaction_data' listesini (içinde string'ler olan) 'anomaly_flags' ile birleştir
+        for i, is_anomaly in enumerate(anomaly_flags):
+            if is_anomaly:
+                anomalous_transaction = transaction_data[i].copy()
+                anomalous_transaction["is_anomaly"] = True
+                anomalous_transaction["score"] = scores[i]
+
+                # Gerçek transaction ID'sini 'id' anahtarından al
+                anomalous_transaction["transaction_id"] = anomalous_transaction.pop('id')
+
+                anomalies.append(anomalous_transaction)
+
+    result = {"total_transactions": len(transaction_data), "anomalies": anomalies}
+    anomaly_result_cache.put(user_id, version, result)
+    return result
@@ -0,0 +1,180 @@
+# services/budget_feature_service.py
+
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from database.db import db
+from models.recurring_transaction_model import RecurringTransaction
+from repositories.transaction_repository import TransactionRepository
+from services.data_version_service import DataVersionService
+
+# Data the features are computed from; a write to any of them invalidates them
+FEATURE_SCOPES = ('transactions', 'recurring')
+AI_FEATURE_CACHE_USERS = int(os.getenv('AI_FEATURE_CACHE_USERS', '1000'))
+
+
+class MonthlyTransactionSummary:
+    """
+    A user's income/expense totals per month, aggregated by the database
+    (TransactionRepository.get_monthly_totals). All the budget features need
+    from the transactions, without loading the rows themselves.
+    """
+
+    def __init__(self, monthly, count):
+        self.monthly = monthly  # {'YYYY-MM': {'income': ..., 'expenses': ...}}
+        self.count = count      # number of transactions
+
+    @classmethod
+    def for_user(cls, user_id):
+        monthly, count = {}, 0
+        for year, month, tx_type, total, rows in TransactionRepository.get_monthly_totals(user_id):
+            totals = monthly.setdefault(f"{int(year):04d}-{int(month):02d}", {'income': 0.0, 'expenses': 0.0})
+            key = 'income' if getattr(tx_type, 'value', tx_type) == 'income' else 'expenses'
+            totals[key] += float(total)
+            count += rows
+        return cls(dict(sorted(monthly.items())), count)
+
+    def __len__(self):
+        return self.count
+
+    def totals(self):
+        """(total_income, total_expenses)"""
+        return (
+            sum(totals['income'] for totals in self.monthly.values()),
+            sum(totals['expenses'] for totals in self.monthly.values())
+        )
+
+    def monthly_totals(self):
+        return self.monthly
+
+
+class BudgetFeatures:
+    """
+    Everything the budget model and the traditional metrics read about one
+    user, built in one pass over the monthly totals and recurring transactions:
+    - sequence: last 6 months of [income, expenses, savings ratio] (LSTM input)
+    - static: 8 user-level features (input of the shared model)
+    - totals and monthly averages, recurring transactions included
+    """
+
+    def __init__(self, sequence, static, total_income, total_expenses, avg_monthly_income, avg_monthly_expenses,
+                 data_points):
+        self.sequence = sequence
+        self.static = static
+        self.total_income = total_income
+        self.total_expenses = total_expenses
+        self.avg_monthly_income = avg_monthly_income
+        self.avg_monthly_expenses = avg_monthly_expenses
+        self.data_points = data_points  # transactions + recurring transactions
+
+    @classmethod
+    def compute(cls, user_id):
+        transactions = MonthlyTransactionSummary.for_user(user_id)
+        recurring_txs = RecurringTransaction.query.filter_by(user_id=user_id).all()
+
+        # Calculate financial features
+        total_income, total_expenses = transactions.totals()
+        monthly_data = transactions.monthly_totals()
+
+        recurring_income = recurring_expenses = 0.0
+        for rt in recurring_txs:
+            if rt.type == 'income':
+                total_income += float(rt.amount)
+                recurring_income += float(rt.amount)
+            else:
+                total_expenses += float(rt.amount)
+                recurring_expenses += float(rt.amount)
+
+        months_with_data = max(len(monthly_data), 1)
+
+        # --- Sequential Data for LSTM (6 months) ---
+        monthly_stats = defaultdict(lambda: {'income': 0, 'expenses': 0})
+
+        for month_key, totals in monthly_data.items():
+            monthly_stats[month_key]['income'] += totals['income']
+            monthly_stats[month_key]['expenses'] += totals['expenses']
+
+        # Recurring transactions count toward each of the last 6 months
+        current_month = datetime.now()
+        for rt in recurring_txs:
+            for i in range(6):
+                m_key = (current_month - timedelta(days=30*i)).strftime('%Y-%m')
+                key = 'income' if rt.type == 'income' else 'expenses'
+                monthly_stats[m_key][key] += float(rt.amount)
+
+        sequence = []
+        for m in sorted(monthly_stats.keys())[-6:]:
+            inc, exp = monthly_stats[m]['income'], monthly_stats[m]['expenses']
+            sequence.append([inc, exp, (inc - exp) / max(inc, 1)])
+
+        while len(sequence) < 6:
+            sequence.insert(0, [0.0, 0.0, 0.0])
+
+        # --- Static user features ---
+        avg_monthly_income = total_income / months_with_data
+        avg_monthly_expenses = total_expenses / months_with_data
+        monthly_expenses = np.array([totals['expenses'] for totals in monthly_data.values()])
+        expense_volatility = (
+            float(monthly_expenses.std() / monthly_expenses.mean())
+            if len(monthly_expenses) and monthly_expenses.mean() > 0 else 0.0
+        )
+        static = [
+            float(np.log1p(avg_monthly_income)),
+            float(np.log1p(avg_monthly_expenses)),
+            max(-1.0, (total_income - total_expenses) / max(total_income, 1)),
+            min(len(monthly_data), 24) / 12,
+            float(np.log1p(len(transactions))),
+            recurring_income / max(total_income, 1),
+            recurring_expenses / max(total_expenses, 1),
+            expense_volatility
+        ]
+
+        return cls(
+            sequence, static, total_income, total_expenses, avg_monthly_income, avg_monthly_expenses,
+            len(transactions) + len(recurring_txs)
+        )
+
+
+class BudgetFeatureExtractor:
+    """
+    Per-user cache of BudgetFeatures for train, prompt and the traditional
+    metrics. An entry is reused while the user's transaction and recurring
+    versions are unchanged (any write through any process bumps them) and
+    for the day it was built, since recurring amounts are laid out from
+    today's date. Least recently used users are evicted.
+    """
+
+    def __init__(self, max_users=AI_FEATURE_CACHE_USERS):
+        self.max_users = max_users
+        self._features = OrderedDict()  # user_id -> (key, BudgetFeatures)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        versions = DataVersionService.get_versions(user_id, FEATURE_SCOPES)
+        key = (versions['transactions'], versions['recurring'], date.today())
+        with self._lock:
+            cached = self._features.get(user_id)
+            if cached is not None and cached[0] == key:
+                self._features.move_to_end(user_id)
+                return cached[1]
+
+        features = BudgetFeatures.compute(user_id)
+        # Data read inside an uncommitted write is not cached: it may be rolled back
+        if not DataVersionService.has_uncommitted_bumps(db.session):
+            with self._lock:
+                self._features[user_id] = (key, features)
+                self._features.move_to_end(user_id)
+                while len(self._features) > self.max_users:
+                    self._features.popitem(last=False)
+        return features
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._features.pop(user_id, None)
+
+
+budget_features = BudgetFeatureExtractor()
@@ -0,0 +1,154 @@
+# services/budget_training_service.py
+
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import torch
+
+from database.db import db
+from models.data_version_model import DataVersion
+from models.recurring_transaction_model import RecurringTransaction
+from models.transaction_model import UserTransaction
+from services.ai_anomaly_service import SHARED_MODEL_KEY, BudgetHybridModel, fit_budget_model
+from services.budget_feature_service import budget_features, FEATURE_SCOPES
+
+
+def _init_worker():
+    # One process per core: intra-op threads would only oversubscribe the CPU
+    torch.set_num_threads(1)
+
+
+def _train_user(user_id, sequence, static):
+    # Runs in a worker process: feature lists in, state dict out
+    x_seq = torch.tensor([sequence], dtype=torch.float32)
+    x_static = torch.tensor([static], dtype=torch.float32)
+    return fit_budget_model(x_seq, x_static, user_id).state_dict()
+
+
+class BudgetTrainingJob:
+    """
+    Off-peak (re)training of the per-user budget models, meant to run nightly
+    so request-time analysis rarely has to train.
+
+    A user is stale when their transaction/recurring versions differ from the
+    ones stored in their model metadata at training time, or when they have
+    no model yet. Stale users are handled in batches of `batch_size` (default:
+    CPU count): the batch's features are extracted, every user's model is
+    trained on a worker process (one model per user, so they can't share a
+    forward pass), and models and metadata are written by AIService.save_model,
+    which renames complete files into place.
+    In shared mode the shared model is retrained once instead.
+    """
+
+    def __init__(self, ai_service, workers=None, batch_size=None, limit=None, report_every=100):
+        self.ai_service = ai_service
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size or self.workers
+        self.limit = limit
+        self.report_every = report_every
+
+    def _current_versions(self):
+        """{user_id: {scope: version}} for every user with transactions or recurring transactions."""
+        user_ids = db.session.query(UserTransaction.user_id).union(
+            db.session.query(RecurringTransaction.user_id)
+        )
+        versions = {row[0]: dict.fromkeys(FEATURE_SCOPES, 0) for row in user_ids}
+        rows = (
+            db.session.query(DataVersion.user_id, DataVersion.scope, DataVersion.version)
+            .filter(DataVersion.scope.in_(FEATURE_SCOPES))
+            .all()
+        )
+        for user_id, scope, version in rows:
+            if user_id in versions:
+                versions[user_id][scope] = version
+        return versions
+
+    def stale_users(self, versions=None):
+        """(user_id, data versions) of users whose model is missing or older than their data."""
+        versions = versions if versions is not None else self._current_versions()
+        # The shared model records the versions of every user it was trained on
+        shared = self.ai_service.model_mode == 'shared'
+        trained_on = self.ai_service.get_metadata(SHARED_MODEL_KEY).get("data_versions", {}) if shared else None
+
+        stale = []
+        for user_id, user_versions in sorted(versions.items()):
+            if not self.ai_service.is_trained(user_id):
+                stale.append((user_id, user_versions))
+                continue
+            metadata_versions = trained_on.get(user_id) if shared else \
+                self.ai_service.get_metadata(user_id).get("data_versions")
+            if metadata_versions != user_versions:
+                stale.append((user_id, user_versions))
+        return stale
+
+    def run(self):
+        """Trains every stale user (at most `limit`) and returns a summary with throughput figures."""
+        self._started = time.monotonic()
+        versions = self._current_versions()
+        stale = self.stale_users(versions)
+        self._counts = {"checked": len(versions), "stale": len(stale), "trained": 0, "failed": 0}
+        if self.limit is not None:
+            stale = stale[:self.limit]
+
+        if self.ai_service.model_mode == 'shared':
+            if stale:
+                self._counts["trained"] = self.ai_service.train_shared(sorted(versions))
+            return self._summary()
+
+        # spawn: workers must not inherit the app's threads or DB connections
+        mp_context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=mp_context, initializer=_init_worker) as pool:
+            for start in range(0, len(stale), self.batch_size):
+                self._train_batch(pool, stale[start:start + self.batch_size])
+        return self._summary()
+
+    def _train_batch(self, pool, batch):
+        in_flight = deque()
+        for user_id, user_versions in batch:
+            features = budget_features.get(user_id)
+            in_flight.append((
+                user_id, user_versions, features,
+                pool.submit(_train_user, user_id, features.sequence, features.static)
+            ))
+        while in_flight:
+            self._collect(*in_flight.popleft())
+
+    def _collect(self, user_id, data_versions, features, future):
+        try:
+            model = BudgetHybridModel()
+            model.load_state_dict(future.result())
+            # The CLI runs in its own process, so the server's per-user locks don't
+            # cover this save. Each file is still renamed into place whole; if a
+            # request-time training of newer data is overwritten, the recorded
+            # data_versions make the user stale again for the next run.
+            self.ai_service.save_model(user_id, model, {
+                "last_train_date": datetime.now().isoformat(),
+                "training_count": features.data_points,
+                "model_type": "hybrid_lstm",
+                "data_versions": data_versions
+            })
+            self._counts["trained"] += 1
+        except Exception as e:
+            print(f"[Training] Training failed for user {user_id}: {e}")
+            self._counts["failed"] += 1
+
+        done = self._counts["trained"] + self._counts["failed"]
+        if done % self.report_every == 0:
+            self._report()
+
+    def _summary(self):
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        return {
+            **self._counts,
+            "elapsed_seconds": round(elapsed, 2),
+            "users_per_second": round(self._counts["trained"] / elapsed, 2)
+        }
+
+    def _report(self):
+        summary = self._summary()
+        print(f"[Training] {summary['trained']}/{summary['stale']} stale users trained, "
+              f"{summary['failed']} failed | {summary['users_per_second']} users/s")
@@ -0,0 +1,114 @@
+# services/data_version_service.py
+
+from datetime import datetime
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from database.db import db, upsert_insert
+from models.data_version_model import DataVersion
+from models.goal_date import GoalDate
+from models.goal_model import Goal
+from models.recurring_transaction_model import RecurringTransaction
+from models.transaction_model import UserTransaction
+
+# session.info flag: this session has bumped versions that are not committed yet
+_UNCOMMITTED_KEY = 'data_versions_uncommitted'
+
+# Model -> version scope bumped when one of its rows changes
+TRACKED_MODELS = {
+    UserTransaction: 'transactions',
+    RecurringTransaction: 'recurring',
+    Goal: 'goals',
+    GoalDate: 'goals',
+}
+
+
+def _owner_ids(session, obj):
+    """Users whose data a new/changed/deleted row belongs (or belonged) to."""
+    if isinstance(obj, GoalDate):
+        # Goal dates have no user_id; they belong to the goal's user
+        goal_ids = {obj.goal_id} | set(inspect(obj).attrs.goal_id.history.deleted)
+        with session.no_autoflush:
+            goals = [session.get(Goal, goal_id) for goal_id in goal_ids if goal_id]
+        return {goal.user_id for goal in goals if goal is not None}
+
+    owners = {obj.user_id} if obj.user_id else set()
+    # A row moved to another user changes both users' data
+    owners.update(inspect(obj).attrs.user_id.history.deleted)
+    return owners
+
+
+class DataVersionService:
+    """
+    Per-user, per-scope version counters kept in the database so every
+    server process sees the same version. Counters are bumped from a
+    before_flush hook, in the same transaction as the data change itself.
+    """
+
+    @staticmethod
+    def get_version(user_id, scope='transactions'):
+        # Column query, not session.get: counters are bumped in SQL, an identity-map copy may be stale
+        version = (
+            db.session.query(DataVersion.version)
+            .filter(DataVersion.user_id == user_id, DataVersion.scope == scope)
+            .scalar()
+        )
+        return version or 0
+
+    @staticmethod
+    def changed_owners(session):
+        """(user_id, scope) pairs touched by the pending flush."""
+        owners = set()
+        for obj in session.new | session.deleted | session.dirty:
+            scope = TRACKED_MODELS.get(type(obj))
+            if not scope or (obj in session.dirty and not session.is_modified(obj)):
+                continue
+            owners.update((user_id, scope) for user_id in _owner_ids(session, obj))
+        return owners
+
+    @staticmethod
+    def get_versions(user_id, scopes):
+        """{scope: version} for several scopes in one query (0 for never written)."""
+        rows = (
+            db.session.query(DataVersion.scope, DataVersion.version)
+            .filter(DataVersion.user_id == user_id, DataVersion.scope.in_(scopes))
+            .all()
+        )
+        versions = dict.fromkeys(scopes, 0)
+        versions.update(rows)
+        return versions
+
+    @staticmethod
+    def has_uncommitted_bumps(session):
+        """True while the session's transaction holds version bumps that may still be rolled back."""
+        return session.info.get(_UNCOMMITTED_KEY, False)
+
+    @classmethod
+    def bump_versions(cls, session):
+        owners = cls.changed_owners(session)
+        if not owners:
+            return
+        session.info[_UNCOMMITTED_KEY] = True
+        # INSERT ... ON CONFLICT DO UPDATE: incremented in SQL, and two first writes
+        # for the same user can't collide on the primary key
+        statement = upsert_insert(DataVersion, session).values([
+            {"user_id": user_id, "scope": scope, "version": 1, "updated_at": datetime.utcnow()}
+            for user_id, scope in sorted(owners)
+        ])
+        statement = statement.on_conflict_do_update(
+            index_elements=[DataVersion.user_id, DataVersion.scope],
+            set_={"version": DataVersion.version + 1, "updated_at": statement.excluded.updated_at}
+        )
+        session.execute(statement)
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_data_versions(session, flush_context, instances):
+    DataVersionService.bump_versions(session)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_soft_rollback')
+def _clear_uncommitted_flag(session, *args):
+    session.info.pop(_UNCOMMITTED_KEY, None)
@@ -150,6 +150,35 @@ class FirebaseService:
             print(f"❌ Bildirim hatası: {e}")
             return False
 
+    @classmethod
+    def send_anomaly_notification(cls, fcm_token, transaction_id, message):
+        """Arka plandaki anomali kontrolü anormal bir harcama bulduğunda bildirim gönder"""
+        if not cls._initialized:
+            cls.initialize()
+
+        if not cls._initialized:
+            return False
+
+        try:
+            notification_message = messaging.Message(
+                notification=messaging.Notification(
+                    title='🚨 Anormal Harcama',
+                    body=message,
+                ),
+                data={
+                    'type': 'anomaly_detected',
+                    'transaction_id': transaction_id,
+                    'message': message,
+                },
+                token=fcm_token,
+            )
+
+            messaging.send(notification_message)
+            return True
+        except Exception as e:
+            print(f"❌ Bildirim hatası: {e}")
+            return False
+
 
 # Datetime import'u
 from datetime import datetime
\ No newline at end of file
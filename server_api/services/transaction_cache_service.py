@@ -0,0 +1,223 @@
+# services/transaction_cache_service.py
+
+import os
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from database.db import db
+from models.transaction_model import UserTransaction, TransactionType
+from services.data_version_service import DataVersionService
+
+# session.info key holding the transaction changes flushed but not yet committed
+_PENDING_KEY = 'transaction_cache_changes'
+
+
+def _naive(date):
+    # Same wall time the DB column (timestamp without time zone) stores
+    return date.replace(tzinfo=None) if date is not None and date.tzinfo is not None else date
+
+
+def _is_income(tx_type):
+    value = tx_type.value if isinstance(tx_type, TransactionType) else str(tx_type)
+    return value == 'income'
+
+
+class UserTransactionColumns:
+    """
+    One user's transactions as parallel NumPy arrays; row i of every array is
+    the same transaction. Instances are never modified in place, so a reader
+    can keep using the arrays it got while the cache moves on to a newer copy.
+    """
+
+    def __init__(self, version, ids, amount, date, is_income, category_code, categories):
+        self.version = version
+        self.ids = ids                      # list of transaction ids
+        self.amount = amount                # float64
+        self.date = date                    # datetime64[us]
+        self.is_income = is_income          # bool
+        self.category_code = category_code  # int32, index into 'categories'
+        self.categories = categories        # list of category ids
+        self.id_index = {transaction_id: i for i, transaction_id in enumerate(ids)}
+
+    @classmethod
+    def from_rows(cls, version, rows):
+        """rows: (id, amount, date, type, category_id) tuples."""
+        categories, category_index = [], {}
+        codes = np.empty(len(rows), dtype=np.int32)
+        for i, row in enumerate(rows):
+            code = category_index.get(row[4])
+            if code is None:
+                code = category_index[row[4]] = len(categories)
+                categories.append(row[4])
+            codes[i] = code
+
+        return cls(
+            version,
+            [row[0] for row in rows],
+            np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows)),
+            np.array([_naive(row[2]) for row in rows], dtype='datetime64[us]'),
+            np.fromiter((_is_income(row[3]) for row in rows), dtype=bool, count=len(rows)),
+            codes,
+            categories
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def category_ids(self):
+        return np.asarray(self.categories, dtype=object)[self.category_code]
+
+    def type_names(self):
+        return np.where(self.is_income, 'income', 'expense')
+
+    def applied(self, changes, version):
+        """
+        Returns a new instance with committed changes applied.
+        changes: {transaction_id: (amount, date, type, category_id) or None for a delete}
+        """
+        keep = np.ones(len(self), dtype=bool)
+        amount, date = self.amount.copy(), self.date.copy()
+        is_income, category_code = self.is_income.copy(), self.category_code.copy()
+        categories = list(self.categories)
+        category_index = {category: code for code, category in enumerate(categories)}
+        appended = []
+
+        for transaction_id, row in changes.items():
+            i = self.id_index.get(transaction_id)
+            if row is None:
+                if i is not None:
+                    keep[i] = False
+                continue
+
+            code = category_index.get(row[3])
+            if code is None:
+                code = category_index[row[3]] = len(categories)
+                categories.append(row[3])
+
+            if i is None:
+                appended.append((transaction_id, row, code))
+            else:
+                keep[i] = True
+                amount[i] = row[0]
+                date[i] = np.datetime64(_naive(row[1]), 'us')
+                is_income[i] = _is_income(row[2])
+                category_code[i] = code
+
+        ids = [transaction_id for transaction_id, kept in zip(self.ids, keep) if kept]
+        ids.extend(transaction_id for transaction_id, _, _ in appended)
+        return UserTransactionColumns(
+            version,
+            ids,
+            np.concatenate([amount[keep], np.array([row[0] for _, row, _ in appended], dtype=np.float64)]),
+            np.concatenate([date[keep], np.array([_naive(row[1]) for _, row, _ in appended], dtype='datetime64[us]')]),
+            np.concatenate([is_income[keep], np.array([_is_income(row[2]) for _, row, _ in appended], dtype=bool)]),
+            np.concatenate([category_code[keep], np.array([code for _, _, code in appended], dtype=np.int32)]),
+            categories
+        )
+
+
+class TransactionColumnCache:
+    """
+    Per-user columnar transaction cache shared by the anomaly paths
+    (POST /anomaly, the per-transaction anomaly check).
+
+    Entries are built with one column query (no ORM objects), kept in sync
+    with writes made through this process's sessions (applied after commit)
+    and checked against the user's transaction version from the database, so
+    writes from other processes cause a reload. Least recently used users
+    are evicted.
+    """
+
+    def __init__(self, max_users=None):
+        if max_users is None:
+            max_users = int(os.getenv('TRANSACTION_CACHE_USERS', '1000'))
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> UserTransactionColumns
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        version = DataVersionService.get_version(user_id, 'transactions')
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None and cached.version == version:
+                self._users.move_to_end(user_id)
+                return cached
+
+        columns = self._load(user_id, version)
+        # Rows read inside an uncommitted write are not cached: they may be rolled back
+        if not db.session.info.get(_PENDING_KEY):
+            self._put(user_id, columns)
+        return columns
+
+    def _load(self, user_id, version):
+        rows = (
+            db.session.query(
+                UserTransaction.id, UserTransaction.amount, UserTransaction.date,
+                UserTransaction.type, UserTransaction.category_id
+            )
+            .filter(UserTransaction.user_id == user_id)
+            .all()
+        )
+        return UserTransactionColumns.from_rows(version, rows)
+
+    def _put(self, user_id, columns):
+        with self._lock:
+            self._users[user_id] = columns
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+    def apply_committed(self, changes, flushes):
+        with self._lock:
+            for user_id, user_changes in changes.items():
+                cached = self._users.get(user_id)
+                if cached is None:
+                    continue
+                # Every flush that touched the user bumped their version by one
+                self._users[user_id] = cached.applied(user_changes, cached.version + flushes.get(user_id, 0))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+transaction_cache = TransactionColumnCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_transaction_changes(session, flush_context):
+    owners = [user_id for user_id, scope in DataVersionService.changed_owners(session) if scope == 'transactions']
+    if not owners:
+        return
+
+    pending = session.info.setdefault(_PENDING_KEY, {'changes': defaultdict(dict), 'flushes': defaultdict(int)})
+    for user_id in owners:
+        pending['flushes'][user_id] += 1
+
+    # Snapshot values now: after commit the objects are expired
+    for obj in session.new | session.dirty:
+        if not isinstance(obj, UserTransaction) or (obj not in session.new and not session.is_modified(obj)):
+            continue
+        for previous_owner in inspect(obj).attrs.user_id.history.deleted:
+            pending['changes'][previous_owner][obj.id] = None
+        pending['changes'][obj.user_id][obj.id] = (obj.amount, obj.date, obj.type, obj.category_id)
+    for obj in session.deleted:
+        if isinstance(obj, UserTransaction):
+            pending['changes'][obj.user_id][obj.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_transaction_changes(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        transaction_cache.apply_committed(pending['changes'], pending['flushes'])
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_transaction_changes(session, previous_transaction):
+    # Cached versions are then behind the database and get reloaded on next use
+    session.info.pop(_PENDING_KEY, None)
@@ -16,4 +16,7 @@ class TransactionService:
     def get_transactions_by_user(self, user_id):
         return self.transactionRepository.get_by_user_id(user_id)
 
+    def get_transactions_with_anomaly(self, user_id, anomalies_only=False):
+        return self.transactionRepository.get_by_user_id_with_anomaly(user_id, anomalies_only)
+
 